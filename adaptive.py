@@ -0,0 +1,73 @@
+"""
+In this module we choose the scores of a sweep adaptively instead of from a
+hand-written list. Starting from a coarse grid on [low, high], new scores are
+only placed next to points where the entropy curve deviates from the straight
+line through its neighbours by more than a tolerance, i.e. where linear
+interpolation of the curve is poor. Flat stretches of the curve therefore get
+few solves while the steep rise towards the maximal score gets many.
+"""
+
+from math import nan
+
+from sweep import run_sweep, sweep_pool
+
+# Entropies below -NEGATIVE_TOL bits come from a relaxation that is unbounded,
+# even where the solver reports the solve as optimal
+NEGATIVE_TOL = 0.01
+
+
+def valid_entropy(solve, entropy):
+    # The entropy of solve, nan if the solve is not optimal, has no dual value
+    # or its value is no bound, e.g. a guessing probability far above 1
+    if solve.status != 'optimal' or solve.dual is None:
+        return nan
+    h = entropy(solve)
+    return h if h >= -NEGATIVE_TOL else nan
+
+
+def entropy_curve(solves, scores, inputs, entropy):
+    # Averages the entropy over the inputs for every score, nan for a score
+    # with a solve that gives no bound
+    return [sum(valid_entropy(solves[(score, inp)], entropy) for inp in inputs) / len(inputs)
+            for score in scores]
+
+
+def _refinements(scores, curve, tol, min_step):
+    new = set()
+    for i in range(1, len(scores) - 1):
+        s0, s1, s2 = scores[i - 1:i + 2]
+        h0, h1, h2 = curve[i - 1:i + 2]
+        # Error of the linear interpolation between the neighbours at s1
+        chord = h0 + (h2 - h0) * (s1 - s0) / (s2 - s0)
+        if abs(h1 - chord) > tol:
+            for a, b in ((s0, s1), (s1, s2)):
+                if b - a > min_step:
+                    new.add((a + b) / 2)
+    return sorted(new)
+
+
+def run_adaptive_sweep(build_problem, low, high, inputs, entropy, tol=0.01, initial=5,
+                       max_points=40, min_step=1e-4, workers=1, solver_threads=1, **kwargs):
+    """
+    Runs sweeps on [low, high] until the averaged entropy curve is resolved to
+    tol bits, at most max_points scores are used or no interval wider than
+    min_step is left to refine. entropy maps a solve to its entropy as ent()
+    in the scripts. Further keyword arguments are passed on to run_sweep.
+    Returns the sorted scores and the solves keyed by (score, inputs).
+    """
+    scores = [low + (high - low) * i / (initial - 1) for i in range(initial)]
+    new = scores
+    solves = {}
+    pool = sweep_pool(build_problem, workers, solver_threads) if workers > 1 else None
+    try:
+        while new:
+            solves.update(run_sweep(build_problem, new, inputs, workers=workers,
+                                    solver_threads=solver_threads, pool=pool, **kwargs))
+            curve = entropy_curve(solves, scores, inputs, entropy)
+            new = _refinements(scores, curve, tol, min_step)
+            new = new[:max(0, max_points - len(scores))]
+            scores = sorted(scores + new)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return scores, solves
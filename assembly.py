@@ -0,0 +1,382 @@
+"""
+In this module we assemble the relaxations of pipeline.py without ncpol2sdpa
+and sympy. get_relaxation keeps the symbolic moment matrix and every
+localizing matrix in memory, which at level 3 or for many outcomes exhausts
+the memory before the solver even starts. Here the operators are integer IDs
+as in monomials.py and a monomial is a word of IDs reduced to a canonical form
+in Python: the parties A, B and W commute, so a word is sorted by party, and
+neighbouring projectors of the same measurement give the projector again or
+zero. The moments of a monomial and its adjoint are taken equal, as in the
+real relaxations of ncpol2sdpa. Moments related by permuting the outcomes,
+such as the bit symmetry of pipeline.py, are merged while the index of the
+moments is built, so F never holds the unmerged relaxation.
+
+The entries of F are generated row by row, in the layout of ncpol2sdpa, and
+written in chunks of CHUNK entries straight to the CSR arrays of F in a
+directory on disk. Beyond the chunk, an assembly keeps the monomials of the
+moment matrix, the index of the moments, which grows with the number of
+moments, and a cache of the orbits of at most CHUNK monomials in memory. Only
+the assembly is bounded this way: the relaxation is loaded as a
+CompiledRelaxation with F read into memory, and the solver copies it once
+more through cvxpy, so solving it takes as much memory as a relaxation built
+by ncpol2sdpa and compiled. What is saved is the symbolic relaxation of
+ncpol2sdpa, which for large problems is far bigger than F.
+"""
+
+import os
+import shutil
+import tempfile
+from itertools import groupby
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+import profiling
+from compiled import CompiledRelaxation
+from monomials import words
+
+# Entries of F buffered before they are written to disk
+CHUNK = 1 << 20
+# Arrays of F in the directory of an assembled relaxation
+ARRAYS = {'indptr': np.int64, 'indices': np.int32, 'data': np.float64}
+# Everything else the relaxation needs, written last so that a directory
+# holding it is complete
+META = 'relaxation.npz'
+
+
+class Scenario:
+    """
+    The projectors of the measurements of A and B with the outcomes of
+    A_config and B_config, the last outcome of every measurement eliminated
+    as by ncp.generate_measurements, and n_w hermitian operators W of Eve
+    that commute with them. ids['A'][x][a] is the ID of the projector of
+    outcome a of measurement x of A, likewise for B, and ids['W'][e] the ID
+    of W_e.
+    """
+
+    def __init__(self, A_config, B_config, n_w):
+        self.party, self.measurement, self.ids = [], [], {}
+        n_measurements = 0
+        for p, (name, config) in enumerate((('A', A_config), ('B', B_config))):
+            self.ids[name] = []
+            for n in config:
+                self.ids[name].append(list(range(len(self.party), len(self.party) + n - 1)))
+                self.party += [p] * (n - 1)
+                self.measurement += [n_measurements] * (n - 1)
+                n_measurements += 1
+        self.ids['W'] = list(range(len(self.party), len(self.party) + n_w))
+        self.party += [2] * n_w
+        self.measurement += [-1] * n_w
+        self.n_ops = len(self.party)
+
+    def flat(self, name):
+        ids = self.ids[name]
+        return [i for P in ids for i in P] if name != 'W' else list(ids)
+
+    def reduce(self, word):
+        # The canonical form of a word, None if its product is zero
+        reduced = []
+        for op in sorted(word, key=self.party.__getitem__):
+            if reduced and self.measurement[op] >= 0 \
+                    and self.measurement[op] == self.measurement[reduced[-1]]:
+                if op != reduced[-1]:
+                    return None
+                continue
+            reduced.append(op)
+        return tuple(reduced)
+
+    def adjoint(self, monomial):
+        # The parties commute, so the adjoint reverses every party on its own
+        return tuple(op for _, ops in groupby(monomial, key=self.party.__getitem__)
+                     for op in reversed(list(ops)))
+
+    def monomials(self, level, families=()):
+        """
+        The monomials of the moment matrix at level with the families of extra
+        monomials of monomials.py, in canonical form, the identity first.
+        """
+        seen = dict.fromkeys([()])
+        layer = [()]
+        for _ in range(level):
+            layer = list(dict.fromkeys(
+                m for m in (self.reduce(u + (op,)) for u in layer for op in range(self.n_ops))
+                if m is not None and m not in seen))
+            seen.update(dict.fromkeys(layer))
+        self._add_families(seen, families)
+        return list(seen)
+
+    def family_monomials(self, families):
+        # The identity and the monomials of families, as the localizing
+        # monomials of pipeline.py
+        seen = dict.fromkeys([()])
+        self._add_families(seen, families)
+        return list(seen)
+
+    def _add_families(self, seen, families):
+        for family in families:
+            for word in words(*(self.flat(name) for name in family)).tolist():
+                m = self.reduce(word)
+                if m is not None:
+                    seen.setdefault(m)
+
+    def relabeling(self, permutation, joint=False):
+        """
+        The map of the operator IDs, as a tuple indexed by ID, that permutes
+        the outcomes of every measurement of A and B and the guesses W with
+        them, a guess of A and B at W[a * n_b + b] if joint. The last outcome
+        is eliminated, so the permutation has to fix it.
+        """
+        n = len(permutation)
+        if permutation[n - 1] != n - 1:
+            raise ValueError("The permutation has to fix the last outcome")
+        image = list(range(self.n_ops))
+        for name in ('A', 'B'):
+            for P in self.ids[name]:
+                if len(P) != n - 1:
+                    raise ValueError("The permutation does not fit the outcomes of %s" % name)
+                for i in range(n - 1):
+                    image[P[i]] = P[permutation[i]]
+        W = self.ids['W']
+        if joint:
+            for a in range(n):
+                for b in range(n):
+                    image[W[a * n + b]] = W[permutation[a] * n + permutation[b]]
+        else:
+            for e in range(n):
+                image[W[e]] = W[permutation[e]]
+        return tuple(image)
+
+    def outcome(self, name, x, a):
+        # The projector of outcome a of measurement x as a polynomial, a dict
+        # of monomials and coefficients, the last one is eliminated
+        P = self.ids[name][x]
+        if a < len(P):
+            return {(P[a],): 1.0}
+        return dict([((), 1.0)] + [((p,), -1.0) for p in P])
+
+    def product(self, *polynomials):
+        result = {(): 1.0}
+        for polynomial in polynomials:
+            terms = {}
+            for u, cu in result.items():
+                for v, cv in polynomial.items():
+                    m = self.reduce(u + v)
+                    if m is not None:
+                        terms[m] = terms.get(m, 0.0) + cu * cv
+            result = terms
+        return result
+
+
+class _Moments:
+    # Index of the moments, the identity is the constant term 0 and a
+    # monomial shares its moment with its adjoint. With relabelings, maps of
+    # the operator IDs under which the problem is invariant, a monomial
+    # shares its moment with its whole orbit as in RelaxationTemplate, the
+    # orbit found right away from the relabelings and the identity as a group.
+
+    def __init__(self, scenario, relabelings=()):
+        self.scenario = scenario
+        self.relabelings = list(relabelings)
+        self.index = {}
+        self._keys = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def _key(self, monomial):
+        key = self._keys.get(monomial)
+        if key is None:
+            scenario = self.scenario
+            images = [monomial] + [scenario.reduce(tuple(g[op] for op in monomial))
+                                   for g in self.relabelings]
+            key = min(min(m, scenario.adjoint(m)) for m in images)
+            # The cache is cleared instead of growing with all products
+            if len(self._keys) >= CHUNK:
+                self._keys.clear()
+            self._keys[monomial] = key
+        return key
+
+    def __call__(self, monomial, new=False):
+        if monomial == ():
+            return 0
+        if self.relabelings:
+            key = self._key(monomial)
+        else:
+            key = min(monomial, self.scenario.adjoint(monomial))
+        k = self.index.get(key)
+        if k is None:
+            if not new:
+                raise ValueError("The moment of %s is not in the relaxation" % (monomial,))
+            k = self.index[key] = len(self.index) + 1
+        return k
+
+    def vector(self, polynomial, n_vars):
+        facvar = np.zeros(n_vars + 1)
+        for monomial, coeff in polynomial.items():
+            facvar[self(monomial)] += coeff
+        return facvar
+
+
+class _CsrWriter:
+    # Appends the rows of F to the CSR arrays in directory, CHUNK entries
+    # at a time
+
+    def __init__(self, directory, chunk=CHUNK):
+        self._files = {name: open(os.path.join(directory, name + '.bin'), 'wb')
+                       for name in ARRAYS}
+        self._chunk = chunk
+        self._buffers = {name: [] for name in ARRAYS}
+        self.nnz = 0
+        self.n_rows = 0
+        self._buffers['indptr'].append(0)
+
+    def row(self, entries):
+        # entries maps columns to coefficients
+        for col, coeff in entries.items():
+            if coeff != 0:
+                self._buffers['indices'].append(col)
+                self._buffers['data'].append(coeff)
+                self.nnz += 1
+        self.empty_rows(1)
+
+    def empty_rows(self, n):
+        self._buffers['indptr'] += [self.nnz] * n
+        self.n_rows += n
+        if len(self._buffers['indptr']) + len(self._buffers['indices']) >= self._chunk:
+            self.flush()
+
+    def flush(self):
+        for name, dtype in ARRAYS.items():
+            np.array(self._buffers[name], dtype=dtype).tofile(self._files[name])
+            self._buffers[name] = []
+
+    def close(self):
+        self.flush()
+        for f in self._files.values():
+            f.close()
+
+
+def _block(writer, moments, monomials, polynomial, new=False):
+    # Streams the upper triangle of the block u^* polynomial v over the
+    # monomials u and v, the moment matrix for the polynomial 1
+    scenario = moments.scenario
+    for i, u in enumerate(monomials):
+        writer.empty_rows(i)
+        u_adj = u[::-1]
+        for v in monomials[i:]:
+            entries = {}
+            for w, coeff in polynomial.items():
+                m = scenario.reduce(u_adj + w + v)
+                if m is not None:
+                    k = moments(m, new)
+                    entries[k] = entries.get(k, 0.0) + coeff
+            writer.row(entries)
+
+
+def assemble(directory, game, A_config, B_config, local, level, score, inputs, families=(),
+             localizing_families=None, permutations=(), chunk=CHUNK):
+    """
+    Writes the relaxation of the guessing probability of the outcome of A
+    (local) or of A and B at the score of game to directory, with the
+    operators W of Eve as in pipeline.py, the NPA level and the families of
+    extra monomials of monomials.py. localizing_families are the families of
+    the localizing monomials of the constraints on W, None for those of
+    ncpol2sdpa. The moments related by the outcome permutations, see
+    Scenario.relabeling, are merged into one variable. The relaxation is
+    written to a temporary directory first, so that concurrent assemblies of
+    the same relaxation do not see each other's partial files.
+    """
+    n_a, n_b = A_config[0], B_config[0]
+    scenario = Scenario(A_config, B_config, n_a if local else n_a * n_b)
+    W = scenario.ids['W']
+    moments = _Moments(scenario, [scenario.relabeling(permutation, not local)
+                                  for permutation in permutations])
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent)
+    try:
+        with profiling.phase('assembly') as counters:
+            monomials = scenario.monomials(level, families)
+            writer = _CsrWriter(tmp, chunk)
+            _block(writer, moments, monomials, {(): 1.0}, new=True)
+            # \sum W_e <= I_{R'} and W_e >= 0, by default localized with the
+            # monomials of degree up to level - 1 as in ncpol2sdpa
+            if localizing_families is None:
+                localizing = [m for m in monomials if len(m) <= level - 1]
+            else:
+                localizing = scenario.family_monomials(localizing_families)
+            operator_inequalities = [dict([((), 1.0)] + [((w,), -1.0) for w in W])]
+            operator_inequalities += [{(w,): 1.0} for w in W]
+            for polynomial in operator_inequalities:
+                _block(writer, moments, localizing, polynomial, new=True)
+            # The score constraint score_expr - score >= 0 as the last 1x1 block
+            C = game.coefficients()
+            score_expr = {(): float(C[:, :, 0, 0].sum())}
+            for x, y, k, l in zip(*np.nonzero(C)):
+                if k > 0 or l > 0:
+                    a = {(scenario.ids['A'][x][k - 1],): 1.0} if k > 0 else {(): 1.0}
+                    b = {(scenario.ids['B'][y][l - 1],): 1.0} if l > 0 else {(): 1.0}
+                    for m, coeff in scenario.product(a, b).items():
+                        score_expr[m] = score_expr.get(m, 0.0) + float(C[x, y, k, l]) * coeff
+            score_row = writer.n_rows
+            entries = {}
+            for m, coeff in score_expr.items():
+                entries[moments(m)] = entries.get(moments(m), 0.0) + coeff
+            entries[0] = entries.get(0, 0.0) - score
+            writer.row(entries)
+            writer.close()
+            block_struct = [len(monomials)] + [len(localizing)] * len(operator_inequalities) + [1]
+            counters.update(n_vars=len(moments), moment_matrix_size=len(monomials),
+                            n_blocks=len(block_struct), nnz=writer.nnz)
+
+        # Objective function, the probability that Eve guesses correctly
+        objectives = []
+        for inp in inputs:
+            if local:
+                guess = [(scenario.outcome('A', inp[0], a), {(W[a],): 1.0}) for a in range(n_a)]
+            else:
+                guess = [(scenario.outcome('A', inp[0], a), scenario.outcome('B', inp[1], b),
+                          {(W[a * n_b + b],): 1.0}) for a in range(n_a) for b in range(n_b)]
+            polynomial = {}
+            for factors in guess:
+                for m, coeff in scenario.product(*factors).items():
+                    polynomial[m] = polynomial.get(m, 0.0) + coeff
+            objectives.append(moments.vector(polynomial, len(moments)))
+
+        np.savez(os.path.join(tmp, META), shape=(writer.n_rows, len(moments) + 1),
+                 block_struct=block_struct, score_row=score_row, score=score,
+                 inputs=np.array(inputs), objectives=np.array(objectives))
+        try:
+            os.rename(tmp, directory)
+        except OSError:
+            # Assembled by another process in the meantime
+            if not os.path.exists(os.path.join(directory, META)):
+                raise
+    finally:
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+
+
+def load(directory):
+    # The assembled relaxation in directory, with F read into memory as the
+    # solvers need it there
+    with np.load(os.path.join(directory, META)) as f:
+        arrays = [np.fromfile(os.path.join(directory, name + '.bin'), dtype=dtype)
+                  for name, dtype in ARRAYS.items()]
+        F = csr_matrix(tuple(arrays[::-1]), shape=tuple(f['shape']))
+        inputs = [tuple(int(i) for i in inp) for inp in f['inputs']]
+        return CompiledRelaxation(F, f['block_struct'], f['score_row'], f['score'], inputs,
+                                  list(f['objectives']))
+
+
+def assembled_problem(directory, *args, **kwargs):
+    """
+    The relaxation assembled in directory, see assemble for the arguments,
+    assembled first if the directory does not hold it yet. Returns the
+    relaxation and the map from inputs to the coefficient vector of the
+    objective, as build_problem of the scripts does.
+    """
+    if not os.path.exists(os.path.join(directory, META)):
+        assemble(directory, *args, **kwargs)
+    relaxation = load(directory)
+    return relaxation, relaxation.objective
@@ -0,0 +1,125 @@
+"""
+In this module we solve several small relaxations in a single solver call.
+For CHSH a solve takes milliseconds, so setting up the solver, its presolve
+and reading the solution back cost as much as the solve itself. Independent
+copies of a relaxation, each with its own score, statistics and objective,
+are therefore stacked into one block-diagonal SDP whose objective is the sum
+of their objectives. Its optimum is the sum of their optima and its primal and
+dual solutions are theirs side by side, so every copy gets its value, the
+dual multiplier of its score constraint and its certified bound as if it had
+been solved alone.
+
+Batches are solved through cvxpy, the parametrized problem of every batch
+size is built once per relaxation and kept. Only the solvers of
+BATCHED_SOLVERS are batched by batch_size: a first-order solver such as SCS
+needs as many iterations as the hardest copy of a batch, each over all of
+them, so a batch is slower than its copies one by one (14.1 s against 8.1 s
+for a CHSH sweep). For the others the batch size is chosen from the number of
+nonzeros of F, relaxations that are large enough for the solve to dominate
+its overhead are not batched at all.
+"""
+
+import time
+import weakref
+from types import SimpleNamespace
+
+import numpy as np
+
+import certificates
+import profiling
+import solvers
+
+# A batch holds copies of a relaxation up to about this many nonzeros of F in
+# total, so relaxations with more nonzeros are solved one by one
+BATCH_NONZEROS = 20000
+MAX_BATCH = 32
+# Interior point solvers whose overhead per call is worth saving
+BATCHED_SOLVERS = ('mosek',)
+
+# Parametrized cvxpy problems of every relaxation by the number of copies
+_problems = weakref.WeakKeyDictionary()
+
+
+def batch_size(template, n_jobs, workers=1, solver='mosek'):
+    """
+    The number of copies of template, a RelaxationTemplate or a
+    CompiledRelaxation, that solver solves together when n_jobs solves are
+    spread over workers. Every worker is left at least one batch, and solvers
+    that are not in BATCHED_SOLVERS solve every copy on its own.
+    """
+    if solver not in BATCHED_SOLVERS:
+        return 1
+    sdp = getattr(template, 'sdp', template)
+    size = min(MAX_BATCH, BATCH_NONZEROS // max(sdp.F.nnz, 1))
+    size = min(size, -(-n_jobs // max(workers, 1)))
+    return max(1, size)
+
+
+def solve_batch(template, problems, solver, parameters=None):
+    """
+    Solves problems, a list of (score, objective) or (score, objective,
+    statistics) with the objective that template.solve minimizes, in one
+    call of solver. Returns for every problem a dict with the dual, primal,
+    status, solution_time, iterations, multiplier and certified bound of its
+    solve. The solution time and the iterations are those of the whole
+    batch, divided evenly for the time.
+    """
+    sdp = getattr(template, 'sdp', template)
+    copies = len(problems)
+    cvx = _problems.setdefault(template, {}).get(copies)
+    if cvx is None:
+        cvx = _problems[template][copies] = solvers.cvxpy_problem(sdp, copies)
+    problem, f0, c, base = cvx
+
+    # The score constraint and the statistics are 1x1 blocks, so only their
+    # constant terms differ between the copies
+    rows = np.concatenate([[template.score_row], template.statistic_rows,
+                           template.statistic_rows + 1])
+    constants, objectives, offsets = [], [], []
+    for score, objective, *statistics in problems:
+        if template.score != score:
+            template.set_score(score)
+        if statistics:
+            template.set_statistics(statistics[0])
+        template.set_objective(objective)
+        constants.append(template.constant_terms())
+        objectives.append(np.array(sdp.obj_facvar, dtype=float))
+        offsets.append(float(sdp.constant_term))
+    blocks = []
+    for f in constants:
+        block = base.copy()
+        block[rows] = f[rows]
+        blocks.append(block)
+    f0.value = np.concatenate(blocks)
+    c.value = np.concatenate(objectives)
+
+    with profiling.phase('solve') as counters:
+        tstart = time.time()
+        problem.solve(solver=solver.upper(), **solvers._cvxpy_parameters(solver, parameters))
+        solution_time = time.time() - tstart
+        counters.update(copies=copies)
+    status = solvers.normalize_status(problem.status)
+    iterations = problem.solver_stats.num_iters
+    x = problem.variables()[0].value
+    n_vars, n_blocks = sdp.n_vars, len(sdp.block_struct)
+    duals = [constraint.dual_value for constraint in problem.constraints]
+
+    results = []
+    with profiling.phase('certify'):
+        for k in range(copies):
+            value = None
+            if x is not None:
+                value = solvers.primal_value(objectives[k] @ x[k * n_vars:(k + 1) * n_vars],
+                                             offsets[k])
+            y_mat = duals[k * n_blocks:(k + 1) * n_blocks]
+            # The copy on its own, as certify and row_dual expect a solved
+            # relaxation
+            copy = SimpleNamespace(F=sdp.F, block_struct=sdp.block_struct,
+                                   y_mat=y_mat, obj_facvar=objectives[k],
+                                   constant_term=offsets[k])
+            dual = solvers.dual_value(y_mat, sdp.block_struct, blocks[k], offsets[k])
+            results.append(dict(dual=dual, primal=value, status=status,
+                                solution_time=solution_time / copies, iterations=iterations,
+                                multiplier=solvers.row_dual(copy, template.score_row),
+                                certified=certificates.certify(copy, constants[k])))
+    return results
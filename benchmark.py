@@ -0,0 +1,126 @@
+"""
+In this script we benchmark building and solving the relaxations of all
+scripts at several NPA levels. Every (problem, level) pair runs in a fresh
+process, so that the peak RSS belongs to that problem alone, and records the
+wall time and peak RSS after each phase (operators, substitutions, extra_monos,
+get_relaxation, solve, certify) together with the size of the relaxation. For the
+min-entropy scripts the relaxation is solved once, at the first score of the
+sweep and for the first inputs.
+
+The results are appended as one JSON object per line to BENCHMARKS, so that
+runs of different commits can be compared, e.g.
+
+    python benchmark.py chsh_min_local echsh_winprob --levels 1 2 --solver scs
+"""
+
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import profiling
+import solvers
+
+# Default file the results are appended to, next to the scripts
+BENCHMARKS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks.jsonl')
+
+# Benchmarked problems, the script and whether it is a min-entropy sweep or a
+# winprob script
+PROBLEMS = {
+    'chsh_min': ('ncpol2sdpa_chsh_min', 'min'),
+    'chsh_min_local': ('ncpol2sdpa_chsh_min_local', 'min'),
+    'cglmp_3_min_local': ('ncpol2sdpa_cglmp_3_min_local', 'min'),
+    'echsh_min_local': ('ncpol2sdpa_echsh_min_local', 'min'),
+    'chsh_winprob': ('ncpol2sdpa_chsh_winprob', 'winprob'),
+    'cglmp_3_winprob': ('ncpol2sdpa_cglmp_3_winprob', 'winprob'),
+    'echsh_winprob': ('ncpol2sdpa_echsh_winprob', 'winprob'),
+}
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+
+def _build_and_solve(module, kind, level, solver, solver_parameters):
+    if kind == 'min':
+        template, objective = module.build_problem(level)
+        template.solve(-objective(*module.INPUTS[0]), solver, solver_parameters)
+        # Streamed relaxations are compiled and hold the solve themselves
+        return getattr(template, 'sdp', template)
+    if hasattr(module, 'k'):
+        sdp = module.build_relaxation(module.k, level)
+    else:
+        sdp = module.build_relaxation(level)
+    return solvers.solve(sdp, solver, solver_parameters)
+
+
+def run_benchmark(name, level, solver, solver_parameters=None):
+    # Runs one benchmark in the current process and returns its record. The
+    # script is imported first, so that imports are not counted as a phase.
+    script, kind = PROBLEMS[name]
+    module = importlib.import_module(script)
+    with profiling.record() as phases:
+        sdp = _build_and_solve(module, kind, level, solver, solver_parameters)
+    return {
+        'problem': name,
+        'level': level,
+        'solver': solvers.label(solver, solver_parameters),
+        'phases': phases,
+        'peak_rss': profiling.peak_rss(),
+        'moment_matrix_size': sdp.block_struct[0],
+        'n_vars': sdp.n_vars,
+        # Every localizing matrix and moment constraint is a block of its own
+        'n_constraints': len(sdp.block_struct) - 1,
+        'status': sdp.status,
+        'primal': sdp.primal,
+        'dual': sdp.dual,
+    }
+
+
+def run_benchmarks(names, levels, solver='auto', solver_parameters=None, output=BENCHMARKS):
+    """
+    Benchmarks every problem of names at every level, each in its own
+    process, and appends the records to output. Returns the records.
+    """
+    solver = solvers.resolve(solver)
+    run = {
+        'date': datetime.now(timezone.utc).isoformat(),
+        'commit': _commit(),
+        'host': platform.node(),
+    }
+    records = []
+    context = multiprocessing.get_context('spawn')
+    for name in names:
+        for level in levels:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                record = pool.submit(run_benchmark, name, level, solver,
+                                     solver_parameters).result()
+            record = dict(run, **record)
+            with open(output, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+            print(f"{name} at level {level}: " + ", ".join(
+                f"{p['phase']} {p['wall_time']:.2f}s" for p in record['phases']) +
+                f", peak RSS {record['peak_rss'] / 2**20:.0f} MiB")
+            records.append(record)
+    return records
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark relaxation building and solving")
+    parser.add_argument('problems', nargs='*', default=list(PROBLEMS), choices=list(PROBLEMS))
+    parser.add_argument('--levels', nargs='+', type=int, default=[1, 2])
+    parser.add_argument('--solver', default='auto')
+    parser.add_argument('--solver-parameters', type=json.loads, default=None,
+                        help="JSON object passed on to the solver, e.g. '{\"eps\": 1e-4}'")
+    parser.add_argument('--output', default=BENCHMARKS)
+    args = parser.parse_args()
+    run_benchmarks(args.problems, args.levels, args.solver, args.solver_parameters, args.output)
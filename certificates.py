@@ -0,0 +1,134 @@
+"""
+In this module we turn the dual solution of a solve into a rigorous bound.
+The solvers only promise the dual value up to their tolerance, so close to the
+classical score the reported entropies can even be slightly negative. The
+relaxations minimize c x + constant_term over the moments x with
+
+    F(x) = F_0 + sum_i x_i F_i >= 0,
+
+and every matrix Y >= 0 gives the lower bound
+
+    c x >= -tr(F_0 Y) - sum_i |c_i - tr(F_i Y)|
+
+on the moments of any quantum strategy, as the moments of products of
+operators of norm at most one, such as projectors and the W of Eve, satisfy
+|x_i| <= 1. The dual matrices of the solver are projected onto the PSD cone
+block by block and shifted by a bound on the error of the eigendecomposition,
+so that no second solve is needed. The rounding errors of the sparse products
+are bounded a priori and the bound is summed up exactly with fractions and
+rounded down, so the certified value is a float that is provably below the
+optimum.
+"""
+
+from decimal import ROUND_FLOOR, Decimal
+from fractions import Fraction
+from math import log2
+
+import numpy as np
+
+# Unit roundoff of double precision
+UNIT = np.finfo(float).eps / 2
+
+
+def _gamma(n):
+    # Bound on the relative error of a sum of n products in floating point
+    return n * UNIT / (1 - n * UNIT)
+
+
+def _psd_blocks(y_mat, block_struct):
+    # The dual matrices projected onto the PSD cone and shifted so that they
+    # are PSD despite the rounding errors of the projection. Blocks of equal
+    # size are decomposed together.
+    blocks = [np.reshape(np.asarray(y, dtype=float), (bs, bs))
+              for y, bs in zip(y_mat, block_struct)]
+    sizes = {}
+    for k, bs in enumerate(block_struct):
+        sizes.setdefault(bs, []).append(k)
+    for bs, ks in sizes.items():
+        Y = np.stack([blocks[k] for k in ks])
+        Y = (Y + np.swapaxes(Y, 1, 2)) / 2
+        if bs == 1:
+            Y = np.maximum(Y, 0)
+        else:
+            values, vectors = np.linalg.eigh(Y)
+            Y = (vectors * np.maximum(values, 0)[:, None, :]) @ np.swapaxes(vectors, 1, 2)
+            Y = (Y + np.swapaxes(Y, 1, 2)) / 2
+            # The computed eigenvalues are those of a matrix within
+            # bs * UNIT * |Y| of Y, which the shift covers twice over
+            norms = np.linalg.norm(Y, axis=(1, 2))
+            shift = np.maximum(0, -np.linalg.eigvalsh(Y)[:, 0]) + 2 * _gamma(bs) * norms
+            Y = Y + shift[:, None, None] * np.eye(bs)
+        for k, block in zip(ks, Y):
+            blocks[k] = block
+    return blocks
+
+
+def dual_bound(F, block_struct, y_mat, obj_facvar, constant_term=0.0, f0=None):
+    """
+    A rigorous lower bound on the optimum of the relaxation with the
+    constraint matrices F (upper triangles of the blocks as in ncpol2sdpa),
+    the objective obj_facvar and constant_term, given the dual matrices
+    y_mat of a solve. f0 are the constant terms the relaxation was solved
+    with, by default the first column of F. The bound holds for all moments
+    of quantum strategies and is rounded down to a float.
+    """
+    c = np.asarray(obj_facvar, dtype=float)
+    F = F.tocsc()
+    f0 = np.asarray(F[:, 0].toarray().ravel() if f0 is None else f0, dtype=float)
+    A = F[:, 1:len(c) + 1]
+    # vec(Y) in the layout of F, the lower triangles of F are empty, so the
+    # entries above the diagonal stand for both of their positions
+    y = []
+    for bs, block in zip(block_struct, _psd_blocks(y_mat, block_struct)):
+        y.append((block * np.where(np.eye(bs, dtype=bool), 1.0, 2.0)).ravel())
+    y = np.concatenate(y)
+
+    a = A.T @ y
+    t0 = f0 @ y
+    # Every product is a sum of at most n terms, whose rounding error is at
+    # most gamma(n) times the sum of their magnitudes. Computing that sum
+    # again rounds, which the factor 2 covers.
+    n = max(int(np.diff(A.indptr).max(initial=0)), np.count_nonzero(f0)) + 1
+    abs_y = np.abs(y)
+    a_error = 2 * _gamma(n) * (abs(A).T @ abs_y)
+    t0_error = 2 * _gamma(n) * (np.abs(f0) @ abs_y)
+
+    bound = Fraction(constant_term) - Fraction(t0) - Fraction(t0_error)
+    bound -= sum(abs(Fraction(ci) - Fraction(ai)) for ci, ai in zip(c.tolist(), a.tolist()))
+    bound -= sum(map(Fraction, a_error.tolist()))
+    value = float(bound)
+    # float() rounds to nearest
+    if Fraction(value) > bound:
+        value = np.nextafter(value, -np.inf)
+    return float(value)
+
+
+def certify(sdp, f0=None):
+    # dual_bound of a solved relaxation, None if the solver reported no dual
+    # matrices
+    y_mat = getattr(sdp, 'y_mat', None)
+    if not y_mat or any(y is None for y in y_mat):
+        return None
+    return dual_bound(sdp.F, sdp.block_struct, y_mat, sdp.obj_facvar, sdp.constant_term, f0)
+
+
+def certified_entropy(solve):
+    """
+    The certified lower bound on the min-entropy -log2(p_guess) of a solve
+    whose certified field is a certified dual bound of a relaxation that
+    minimizes -p_guess, or None if the solve has no certificate.
+    """
+    certified = getattr(solve, 'certified', None)
+    if certified is None:
+        return None
+    p_guess = -certified
+    if p_guess >= 1:
+        return 0.0
+    # log2 is accurate to an ulp or so, two steps down are on the safe side
+    return max(0.0, float(np.nextafter(np.nextafter(-log2(p_guess), -np.inf), -np.inf)))
+
+
+def round_down(value, digits=6):
+    # value rounded down to digits decimals as a string, for reports that
+    # must not claim more than is certified
+    return str(Decimal(value).quantize(Decimal(1).scaleb(-digits), rounding=ROUND_FLOOR))
@@ -0,0 +1,341 @@
+"""
+In this module we spread the solves of a sweep over several machines. A
+coordinator turns a spec of pipeline.py into one job per score and inputs,
+puts them on a queue and writes the solves that come back to the result
+store, so only the coordinator needs the store. Workers on any node take jobs
+off the queue, build the relaxation of the spec once and solve all of its
+jobs they get.
+
+A worker holds a lease on every job it works on and renews it while the solve
+runs. Jobs whose lease runs out, because their worker died or lost its node,
+are put back on the queue, as are jobs whose solve failed, until they have
+been tried max_attempts times.
+
+The queue is any object with the methods of DirectoryQueue, which keeps the
+jobs as JSON files in a directory that all nodes can see, e.g. on a shared
+file system. For a test on a single machine the coordinator can start local
+worker processes on a temporary directory, e.g.
+
+    python cluster.py run specs/echsh_3_min_local.toml /tmp/queue --local-workers 4
+
+and on a cluster every node runs
+
+    python cluster.py work /shared/queue --idle 600
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from multiprocessing import Process
+
+import pipeline
+import solvers
+import sweep
+from adaptive import entropy_curve
+from store import RESULTS_DB, ResultStore, SolveLog, fingerprint, problem_hash
+
+# Seconds after which a job whose lease was not renewed is put back on the queue
+LEASE = 300
+# Seconds between two looks at the queue
+POLL = 1.0
+
+# Spec whose relaxation the worker process holds, see _build
+_spec_key = None
+
+
+class DirectoryQueue:
+    """
+    A queue of jobs kept as JSON files in the directories pending, claimed
+    and done under path. Jobs are claimed by renaming them from pending to
+    claimed, which only one worker can do, and the modification time of a
+    claimed job is its lease.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        for state in ('pending', 'claimed', 'done'):
+            os.makedirs(os.path.join(path, state), exist_ok=True)
+
+    def _file(self, state, job_id):
+        return os.path.join(self.path, state, job_id + '.json')
+
+    def _write(self, state, job_id, data):
+        # Written under a temporary name first, so that nobody reads half a job
+        path = self._file(state, job_id)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.replace(path + '.tmp', path)
+
+    def put(self, job):
+        self._write('pending', job['id'], job)
+
+    def claim(self):
+        # A pending job, now claimed with a fresh lease, or None
+        for name in sorted(os.listdir(os.path.join(self.path, 'pending'))):
+            if not name.endswith('.json'):
+                continue
+            job_id = name[:-5]
+            try:
+                # The rename keeps the modification time, so the lease starts
+                # before it
+                os.utime(self._file('pending', job_id))
+                os.rename(self._file('pending', job_id), self._file('claimed', job_id))
+            except FileNotFoundError:
+                # Claimed by another worker in the meantime
+                continue
+            with open(self._file('claimed', job_id)) as f:
+                return json.load(f)
+        return None
+
+    def renew(self, job_id):
+        try:
+            os.utime(self._file('claimed', job_id))
+        except FileNotFoundError:
+            pass
+
+    def finish(self, job_id, result):
+        self._write('done', job_id, result)
+        self._remove('claimed', job_id)
+
+    def result(self, job_id):
+        # The result of a finished job, which is taken off the queue, or None
+        try:
+            with open(self._file('done', job_id)) as f:
+                result = json.load(f)
+        except FileNotFoundError:
+            return None
+        self._remove('done', job_id)
+        return result
+
+    def expired(self, lease):
+        # Takes the claimed jobs whose lease ran out off the queue and returns them
+        jobs = []
+        now = time.time()
+        for entry in os.scandir(os.path.join(self.path, 'claimed')):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                if now - entry.stat().st_mtime < lease:
+                    continue
+                with open(entry.path) as f:
+                    jobs.append(json.load(f))
+                os.remove(entry.path)
+            except FileNotFoundError:
+                # Finished in the meantime
+                continue
+        return jobs
+
+    def cancel(self, job_id):
+        # Removes every copy of a job that is answered
+        for state in ('pending', 'claimed', 'done'):
+            self._remove(state, job_id)
+
+    def _remove(self, state, job_id):
+        try:
+            os.remove(self._file(state, job_id))
+        except FileNotFoundError:
+            pass
+
+
+def _build(spec, solver_threads):
+    # Makes sure that this worker process holds the relaxation of spec
+    global _spec_key
+    key = problem_hash(spec)
+    if key != _spec_key:
+        sweep._init_worker(pipeline.spec_build(spec), solver_threads)
+        _spec_key = key
+
+
+def _renewing(queue, job_id, interval, done):
+    # Renews the lease of a job until done is set
+    while not done.wait(interval):
+        queue.renew(job_id)
+
+
+def work(queue, idle=None, solver_threads=1, poll=POLL):
+    """
+    Solves jobs of queue until no job came for idle seconds, or forever if
+    idle is None. Returns the number of jobs done.
+    """
+    done_jobs = 0
+    last = time.time()
+    while True:
+        job = queue.claim()
+        if job is None:
+            if idle is not None and time.time() - last > idle:
+                return done_jobs
+            time.sleep(poll)
+            continue
+        done = threading.Event()
+        renewer = threading.Thread(target=_renewing,
+                                   args=(queue, job['id'], job['lease'] / 3, done), daemon=True)
+        renewer.start()
+        try:
+            _build(job['spec'], solver_threads)
+            solve = sweep._try_solve((job['score'], tuple(job['inputs'])), job['solver'],
+                                     solver_threads, job['spec']['solver_parameters'])
+        except Exception as e:
+            solve = sweep.Failure(repr(e))
+        finally:
+            done.set()
+            renewer.join()
+        if isinstance(solve, sweep.Failure):
+            queue.finish(job['id'], {'error': solve.error, 'host': os.uname().nodename})
+        else:
+            queue.finish(job['id'], {'solve': solve._asdict(), 'host': os.uname().nodename})
+        done_jobs += 1
+        last = time.time()
+
+
+def _answers(inputs, symmetries):
+    # Maps the first input of every group of symmetries to the inputs it
+    # answers. The coordinator never builds the relaxation, so only the
+    # declared symmetries are used.
+    representative = {inp: inp for inp in inputs}
+    for group in symmetries or []:
+        group = [representative[tuple(inp)] for inp in group]
+        for inp, rep in representative.items():
+            if rep in group:
+                representative[inp] = group[0]
+    answers = {}
+    for inp in inputs:
+        answers.setdefault(representative[inp], []).append(inp)
+    return answers
+
+
+def run_distributed_sweep(spec, queue, store=None, lease=LEASE, max_attempts=3, poll=POLL,
+                          local_workers=0, solver_threads=1):
+    """
+    Solves the scores and inputs of spec, checked by pipeline.check_spec, on
+    the workers of queue and returns the solves keyed by (score, inputs) as
+    run_sweep does. Solves already in store or in the log of the spec are not
+    repeated, new ones are added as soon as they come back. The solver is
+    resolved here, so every worker uses the same one.
+
+    Inputs are only merged by the symmetries of the spec. Only the mode
+    'sweep' is supported, without statistics, continuations or batches, for
+    which a ValueError is raised. With local_workers, that many worker
+    processes are started on this machine for the duration of the sweep.
+    Jobs that failed max_attempts times raise a RuntimeError once all other
+    jobs are recorded.
+    """
+    unsupported = ["the mode %s" % spec['mode']] if spec['mode'] != 'sweep' else []
+    unsupported += [key for key in ('statistics', 'continuation', 'batch') if spec[key]]
+    if unsupported:
+        raise ValueError("Distributed sweeps do not support %s" % ", ".join(unsupported))
+    solver = solvers.resolve(spec['solver'])
+    label = solvers.label(solver, spec['solver_parameters'])
+    problem = pipeline.problem_description(spec)
+    inputs = pipeline.spec_inputs(spec)
+    sinks = [sink for sink in (store, SolveLog(spec['log']) if spec['log'] else None)
+             if sink is not None]
+    solves = {}
+    for score in pipeline.spec_scores(spec):
+        for inp in inputs:
+            for sink in sinks:
+                solve = sink.get(problem, score, inp, label)
+                if solve is not None:
+                    solves[(score, inp)] = solve
+                    break
+
+    # Every job answers its inputs at its score
+    jobs = {}
+    for score in pipeline.spec_scores(spec):
+        for rep, answered in _answers(inputs, spec['symmetries']).items():
+            answered = [inp for inp in answered if (score, inp) not in solves]
+            if answered:
+                job_id = fingerprint(problem, score, rep, label)
+                jobs[job_id] = ({'id': job_id, 'spec': spec, 'score': score, 'inputs': rep,
+                                 'solver': solver, 'lease': lease, 'attempts': 1}, answered)
+    for job, _ in jobs.values():
+        queue.put(job)
+
+    processes = [Process(target=work, args=(queue, None, solver_threads, poll), daemon=True)
+                 for _ in range(local_workers)]
+    for process in processes:
+        process.start()
+    failures = []
+    try:
+        while jobs:
+            # Jobs to put back on the queue with the reason they came back
+            retry = {job['id']: "lease expired" for job in queue.expired(lease)
+                     if job['id'] in jobs}
+            for job_id in list(jobs):
+                result = queue.result(job_id)
+                if result is None:
+                    continue
+                job, answered = jobs[job_id]
+                if 'error' in result:
+                    retry[job_id] = result['error']
+                    continue
+                solve = sweep.Solve(**result['solve'])
+                for inp in answered:
+                    solves[(job['score'], inp)] = solve
+                    for sink in sinks:
+                        sink.put(problem, job['score'], inp, label, solve)
+                queue.cancel(job_id)
+                del jobs[job_id]
+            for job_id, error in retry.items():
+                if job_id not in jobs:
+                    # Its lease expired, but its result came in the same poll
+                    continue
+                job, answered = jobs[job_id]
+                if job['attempts'] < max_attempts:
+                    jobs[job_id] = (dict(job, attempts=job['attempts'] + 1), answered)
+                    queue.put(jobs[job_id][0])
+                else:
+                    failures.append(((job['score'], job['inputs']), error))
+                    queue.cancel(job_id)
+                    del jobs[job_id]
+            if jobs:
+                time.sleep(poll)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()
+
+    if failures:
+        raise RuntimeError("%d solves failed, all others are recorded: %s" % (
+            len(failures), "; ".join("%s: %s" % failure for failure in failures)))
+    return solves
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run sweeps on several machines")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help="queue the jobs of a spec and collect their solves")
+    run.add_argument('spec', help="JSON, TOML or YAML spec, see pipeline.py")
+    run.add_argument('queue', nargs='?', default=None,
+                     help="queue directory, a temporary one if not given")
+    run.add_argument('--store', default=RESULTS_DB,
+                     help="SQLite result store the solves are written to")
+    run.add_argument('--local-workers', type=int, default=0,
+                     help="number of worker processes started on this machine")
+    run.add_argument('--lease', type=float, default=LEASE,
+                     help="seconds after which the job of a silent worker is requeued")
+    run.add_argument('--max-attempts', type=int, default=3)
+    worker = commands.add_parser('work', help="solve jobs of a queue")
+    worker.add_argument('queue', help="queue directory")
+    worker.add_argument('--idle', type=float, default=None,
+                        help="stop after this many seconds without a job")
+    worker.add_argument('--solver-threads', type=int, default=1)
+    args = parser.parse_args()
+    if args.command == 'work':
+        print("%d jobs done" % work(DirectoryQueue(args.queue), args.idle, args.solver_threads))
+    else:
+        spec = pipeline.load_spec(args.spec)
+        queue = DirectoryQueue(args.queue or tempfile.mkdtemp(prefix='minentropy-queue-'))
+        store = ResultStore(args.store)
+        try:
+            solves = run_distributed_sweep(spec, queue, store, args.lease, args.max_attempts,
+                                           local_workers=args.local_workers,
+                                           solver_threads=spec['solver_threads'])
+        finally:
+            store.close()
+        scores = pipeline.spec_scores(spec)
+        inputs = pipeline.spec_inputs(spec)
+        for score, h in zip(scores, entropy_curve(solves, scores, inputs, pipeline.ent)):
+            print(f"For a score {score} we find an average entropy of {h}")
@@ -0,0 +1,191 @@
+"""
+In this module we keep built relaxations on disk. Building a relaxation means
+importing ncpol2sdpa and sympy and expanding every constraint, which for small
+problems takes far longer than solving it. A CompiledRelaxation holds only the
+numbers a solver needs: F in sparse form, the block structure, the row of the
+score constraint and the objective coefficients of every input. It is saved
+as an uncompressed .npz file named by a fingerprint of the problem and of the
+script that built it, and is always solved through cvxpy, so a run that finds
+it never imports sympy.
+"""
+
+import hashlib
+import os
+import sys
+from functools import partial
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+import certificates
+import profiling
+import solvers
+from store import problem_hash
+
+# Directory of the compiled relaxations, next to the scripts
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+# Version of the file layout, part of every fingerprint
+FORMAT = 2
+# Modules that build relaxations for the scripts, their sources are part of
+# every fingerprint as well
+SOURCES = ('relaxation', 'monomials', 'games', 'assembly', 'decomposition')
+
+
+class CompiledRelaxation:
+    """
+    A relaxation that can be used in place of a RelaxationTemplate by
+    run_sweep. Objectives are coefficient vectors [constant term, coefficient
+    of every SDP variable] as computed by compile, and solve returns
+    the relaxation itself, which carries primal, dual, status and
+    solution_time like an ncp.SdpRelaxation.
+    """
+
+    def __init__(self, F, block_struct, score_row, score, inputs, objectives,
+                 statistic_rows=(), statistics=()):
+        self.F = F
+        self.block_struct = [int(bs) for bs in block_struct]
+        self.n_vars = F.shape[1] - 1
+        self.score_row = int(score_row)
+        # F holds the score constraint for the score it was compiled at
+        self.score = self._compiled_score = float(score)
+        # Likewise for the moment equalities of the statistics
+        self.statistic_rows = np.array(statistic_rows, dtype=int)
+        self.statistics = self._compiled_statistics = np.array(statistics, dtype=float)
+        # Coefficient vector of the objective of every input
+        self.objectives = dict(zip(inputs, objectives))
+        self.obj_facvar = np.zeros(self.n_vars)
+        self.constant_term = 0.0
+        self.primal = self.dual = None
+        self.status = "unsolved"
+        self.solution_time = None
+        self.iterations = None
+        self.multiplier = None
+        self.certified = None
+        self.y_mat = None
+        self._cvx = None
+
+    @classmethod
+    def compile(cls, template, objective, inputs):
+        # Takes the numbers out of a built RelaxationTemplate, with the
+        # objective of every entry of inputs
+        sdp = template.sdp
+        F = csr_matrix(sdp.F)[:, :sdp.n_vars + 1]
+        objectives = [np.asarray(template._facvar(objective(*inp)), dtype=float)
+                      for inp in inputs]
+        return cls(F, sdp.block_struct, template.score_row, template.score, inputs, objectives,
+                   template.statistic_rows, template.statistics)
+
+    def save(self, path):
+        inputs = list(self.objectives)
+        np.savez(path, data=self.F.data, indices=self.F.indices, indptr=self.F.indptr,
+                 shape=self.F.shape, block_struct=self.block_struct,
+                 score_row=self.score_row, score=self._compiled_score,
+                 inputs=np.array(inputs), objectives=np.array([self.objectives[inp]
+                                                                for inp in inputs]),
+                 statistic_rows=self.statistic_rows, statistics=self._compiled_statistics)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            F = csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+            inputs = [tuple(int(i) for i in inp) for inp in f['inputs']]
+            return cls(F, f['block_struct'], f['score_row'], f['score'], inputs,
+                       list(f['objectives']), f['statistic_rows'], f['statistics'])
+
+    def objective(self, *inputs):
+        return self.objectives[inputs]
+
+    def objective_key(self, objective):
+        return tuple(round(float(c), 12) for c in objective)
+
+    def set_score(self, score):
+        self.score = score
+        self.status = "unsolved"
+
+    def set_statistics(self, values):
+        values = np.asarray(values, dtype=float)
+        if values.shape != self.statistics.shape:
+            raise ValueError("Expected %d observed values, got %s"
+                             % (len(self.statistics), values.shape))
+        self.statistics = values
+        self.status = "unsolved"
+
+    def set_objective(self, objective):
+        self.constant_term = float(objective[0])
+        self.obj_facvar = np.asarray(objective[1:], dtype=float)
+        self.status = "unsolved"
+
+    def constant_terms(self):
+        # The constant terms of all rows of F at the current score and
+        # statistics, F still holds the ones it was compiled with
+        f0 = self.F[:, 0].toarray().ravel()
+        f0[self.score_row] += self._compiled_score - self.score
+        # The pairs of blocks of the statistics m - value and value - m
+        change = self._compiled_statistics - self.statistics
+        f0[self.statistic_rows] += change
+        f0[self.statistic_rows + 1] -= change
+        return f0
+
+    def solve(self, objective, solver='mosek', solverparameters=None, warm_start=False):
+        self.set_objective(objective)
+        f0 = self.constant_terms()
+        with profiling.phase('solve'):
+            if self._cvx is None:
+                self._cvx = solvers.cvxpy_problem(self)
+            # The score constraint and the statistics are 1x1 blocks, so
+            # their constant terms are the only ones that change
+            base = self._cvx[3]
+            rows = np.concatenate([[self.score_row], self.statistic_rows,
+                                   self.statistic_rows + 1])
+            base[rows] = f0[rows]
+            self.iterations = solvers.solve_cvxpy(self, solver, solverparameters,
+                                                  self._cvx, warm_start)
+        self.multiplier = solvers.row_dual(self, self.score_row)
+        with profiling.phase('certify'):
+            self.certified = certificates.certify(self, f0)
+        return self
+
+
+def fingerprint(problem, build_problem):
+    # The problem description together with the sources of the script and of
+    # the modules it builds with, so that editing any of them invalidates the
+    # compiled relaxations. A partial such as the build_problem of a spec
+    # counts as the function it wraps. The modules are read from their files,
+    # not imported, so that a cache hit never loads sympy.
+    module = getattr(build_problem, 'func', build_problem).__module__
+    directory = os.path.dirname(os.path.abspath(__file__))
+    paths = [sys.modules[module].__file__]
+    paths += [os.path.join(directory, name + '.py') for name in SOURCES]
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    key = "%s %s %d" % (problem_hash(problem), digest.hexdigest(), FORMAT)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def load_problem(path):
+    # build_problem of a compiled relaxation, returns it with its objective
+    relaxation = CompiledRelaxation.load(path)
+    return relaxation, relaxation.objective
+
+
+def cached_problem(build_problem, problem, inputs, cache_dir=CACHE_DIR):
+    """
+    Returns a function that can be passed to run_sweep in place of
+    build_problem and loads the compiled relaxation of the problem
+    description problem with the objectives of inputs. If the cache holds no
+    such relaxation yet, it is built once with build_problem and saved.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    # The relaxation only holds the objectives of inputs
+    key = dict(problem, inputs=[list(inp) for inp in inputs])
+    path = os.path.join(cache_dir, fingerprint(key, build_problem) + '.npz')
+    if not os.path.exists(path):
+        template, objective = build_problem()
+        # Relaxations such as the decomposition are assembled compiled
+        if not isinstance(template, CompiledRelaxation):
+            template = CompiledRelaxation.compile(template, objective, inputs)
+        template.save(path + '.tmp.npz')
+        os.replace(path + '.tmp.npz', path)
+    return partial(load_problem, path)
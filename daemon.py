@@ -0,0 +1,223 @@
+"""
+In this module we keep a solver process running between queries. Every run of
+a script or of pipeline.py first imports ncpol2sdpa, sympy, numpy and the
+solver bindings and builds its relaxation, which for CHSH takes far longer
+than the solves. The daemon does this once: it imports everything when it
+starts and keeps the relaxations of the last MAX_RELAXATIONS problems, so a
+query only pays for its solves.
+
+Queries are specs of pipeline.py, sent by path or as a mapping over a Unix
+socket that only the user running the daemon can open. They are answered in
+the order they arrive, and their solves are written to the result store of
+the daemon. The client side only needs the standard library, e.g.
+
+    python daemon.py serve &
+    python daemon.py submit specs/chsh_min_local.json
+    python daemon.py stop
+
+or from Python
+
+    scores, solves, entropies = submit({"game": "chsh", "scores": [0.8, 0.85]})
+"""
+
+import argparse
+import importlib
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from multiprocessing.connection import Client, Listener
+
+# Socket of the daemon
+ADDRESS = os.path.join(tempfile.gettempdir(), 'minentropy-sdps-%d.sock' % os.getuid())
+# Number of relaxations kept in memory, the least recently used one is dropped
+MAX_RELAXATIONS = 8
+# Modules imported when the daemon starts, those that are not installed are
+# skipped
+WARM_MODULES = ('ncpol2sdpa', 'sympy', 'cvxpy', 'mosek', 'relaxation')
+# Fields of sweep.Solve sent back to the clients
+SOLVE_FIELDS = ('dual', 'primal', 'status', 'solution_time', 'iterations', 'multiplier',
+                'certified')
+
+
+class _Warm:
+    # Builds the relaxation of a spec on the first call and returns the same
+    # one on every later call, so that sweep keeps re-solving it
+
+    def __init__(self, build):
+        self._build = build
+        self._problem = None
+
+    def __call__(self):
+        if self._problem is None:
+            self._problem = self._build()
+        return self._problem
+
+
+def _plain(value):
+    # Numbers as Python floats, so that clients do not need numpy to unpickle
+    # the answers
+    if value is None or isinstance(value, (str, int)):
+        return value
+    return float(value)
+
+
+class Daemon:
+    """
+    Answers the queries of clients with the relaxations of recent specs kept
+    in memory. The solves are written to store, a ResultStore, if it is given.
+    """
+
+    def __init__(self, store=None, max_relaxations=MAX_RELAXATIONS):
+        # Everything a query may need is imported here, not in the first query
+        for module in WARM_MODULES:
+            try:
+                importlib.import_module(module)
+            except ImportError:
+                pass
+        import pipeline
+        import solvers
+        from adaptive import entropy_curve
+        from store import problem_hash
+        self._pipeline, self._solvers = pipeline, solvers
+        self._entropy_curve, self._problem_hash = entropy_curve, problem_hash
+        self.store = store
+        self.max_relaxations = max_relaxations
+        self._builds = OrderedDict()
+        self._resolved = {}
+
+    def _build(self, spec):
+        # The build function of spec, shared by all specs of the same
+        # relaxation. Everything but the sweep itself is part of the key.
+        pipeline = self._pipeline
+        key = self._problem_hash(dict(pipeline.problem_description(spec),
+                                      formulation=spec['formulation'],
+                                      assembly=spec['assembly'], cache=spec['cache'],
+                                      inputs=pipeline.spec_inputs(spec)))
+        if key not in self._builds:
+            self._builds[key] = _Warm(pipeline.spec_build(spec))
+            while len(self._builds) > self.max_relaxations:
+                self._builds.popitem(last=False)
+        self._builds.move_to_end(key)
+        return self._builds[key]
+
+    def run(self, query):
+        """
+        Runs query, a dict with the path of a spec or the spec itself, and
+        returns the scores, the solves as (score, inputs, fields of the solve)
+        and the entropies averaged over the inputs.
+        """
+        pipeline = self._pipeline
+        spec = query['spec'] if 'spec' in query else pipeline._read(query['path'])
+        spec = pipeline.check_spec(spec)
+        # Worker processes would have to import and build everything again
+        spec['workers'] = 1
+        # Checking out a MOSEK license takes longer than a CHSH solve
+        if spec['solver'] not in self._resolved:
+            self._resolved[spec['solver']] = self._solvers.resolve(spec['solver'])
+        spec['solver'] = self._resolved[spec['solver']]
+        scores, solves = pipeline.run_spec(spec, self.store, self._build(spec))
+        inputs = pipeline.spec_inputs(spec)
+        entropies = self._entropy_curve(solves, scores, inputs, pipeline.ent)
+        return {
+            'scores': [float(score) for score in scores],
+            'solves': [(float(score), inp, {field: _plain(getattr(solve, field))
+                                            for field in SOLVE_FIELDS})
+                       for (score, inp), solve in solves.items()],
+            'entropies': [float(h) for h in entropies],
+        }
+
+
+def serve(address=ADDRESS, store=None, max_relaxations=MAX_RELAXATIONS):
+    """
+    Answers queries on the Unix socket address until a client sends 'stop'.
+    A failed query is answered with its error and does not stop the daemon.
+    """
+    daemon = Daemon(store, max_relaxations)
+    if os.path.exists(address):
+        os.remove(address)
+    # The socket is only opened by the user running the daemon, as queries
+    # are unpickled
+    umask = os.umask(0o177)
+    try:
+        listener = Listener(address, family='AF_UNIX')
+    finally:
+        os.umask(umask)
+    print("Serving on %s" % address, flush=True)
+    with listener:
+        while True:
+            with listener.accept() as connection:
+                try:
+                    query = connection.recv()
+                except EOFError:
+                    continue
+                if query == 'stop':
+                    connection.send({'stopped': True})
+                    break
+                if query == 'ping':
+                    connection.send({'pong': True})
+                    continue
+                tstart = time.time()
+                try:
+                    answer = daemon.run(query)
+                except Exception as e:
+                    answer = {'error': repr(e)}
+                answer['time'] = time.time() - tstart
+                connection.send(answer)
+
+
+def _request(query, address):
+    with Client(address, family='AF_UNIX') as connection:
+        connection.send(query)
+        return connection.recv()
+
+
+def submit(spec, address=ADDRESS):
+    """
+    Runs spec, the path of a spec file or a spec mapping, on the daemon at
+    address and returns the scores, the solves keyed by (score, inputs) as
+    dicts with the fields of sweep.Solve and the entropies averaged over the
+    inputs. Raises a RuntimeError if the query failed.
+    """
+    if isinstance(spec, str):
+        query = {'path': os.path.abspath(spec)}
+    else:
+        query = {'spec': dict(spec)}
+    answer = _request(query, address)
+    if 'error' in answer:
+        raise RuntimeError("The query failed: %s" % answer['error'])
+    solves = {(score, tuple(inp)): solve for score, inp, solve in answer['solves']}
+    return answer['scores'], solves, answer['entropies']
+
+
+def stop(address=ADDRESS):
+    return _request('stop', address)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep a solver process running between queries")
+    parser.add_argument('--address', default=ADDRESS, help="Unix socket of the daemon")
+    commands = parser.add_subparsers(dest='command', required=True)
+    server = commands.add_parser('serve', help="answer queries until stopped")
+    server.add_argument('--store', default=None,
+                        help="SQLite result store the solves are written to, "
+                             "by default the one of the scripts")
+    server.add_argument('--max-relaxations', type=int, default=MAX_RELAXATIONS)
+    client = commands.add_parser('submit', help="run specs on the daemon")
+    client.add_argument('specs', nargs='+', help="JSON, TOML or YAML specs, see pipeline.py")
+    commands.add_parser('stop', help="stop the daemon")
+    args = parser.parse_args()
+    if args.command == 'serve':
+        from store import RESULTS_DB, ResultStore
+        store = ResultStore(args.store or RESULTS_DB)
+        try:
+            serve(args.address, store, args.max_relaxations)
+        finally:
+            store.close()
+    elif args.command == 'submit':
+        for path in args.specs:
+            scores, _, entropies = submit(path, args.address)
+            for score, h in zip(scores, entropies):
+                print(f"{path}: for a score {score} we find an average entropy of {h}")
+    else:
+        stop(args.address)
@@ -0,0 +1,109 @@
+"""
+In this module we compute guessing probabilities without the operators W of
+Eve. If Eve guesses e, the devices are left in a sub-normalized behaviour
+p_e, so the guessing probability of the outcome of A for input x is the
+maximum of sum_e p_e(e | x) over the decompositions p = sum_e p_e of
+behaviours with the required score. Every p_e is relaxed by its own NPA
+moment matrix of the bare Bell scenario, in which the entry of the identity
+is the weight q_e of the guess instead of 1, and the blocks are only linked by
+sum_e q_e = 1 and the score of sum_e p_e. For H_min(AB|E) Eve guesses pairs of
+outcomes (a, b) instead.
+
+The moment matrices of the Bell scenario are much smaller than the one moment
+matrix of A, B and W with its extra monomials, so the SDP of the
+decomposition is solved faster and in less memory. Both formulations relax
+the same guessing probability, but from different sides, so their values
+agree up to the gaps of the relaxations, see pipeline.py for a cross-check.
+
+The relaxation is assembled as a CompiledRelaxation, so it is solved through
+cvxpy and can be swept, cached and certified like the relaxations with W.
+"""
+
+from itertools import product
+
+import numpy as np
+from scipy.sparse import block_diag, csr_matrix, hstack, vstack
+
+import profiling
+from compiled import CompiledRelaxation
+from monomials import extra_monomials
+
+
+def _outcome(P, i):
+    # Projector of outcome i, the last one is eliminated
+    return P[i] if i < len(P) else 1 - sum(P)
+
+
+def decomposed_problem(game, A_config, B_config, local, level, score, inputs, families=()):
+    """
+    The relaxation of the guessing probability of the outcome of A (local)
+    or of A and B at the score of game, with the NPA level and the families
+    of extra monomials of monomials.py, which may only contain A and B.
+    Returns the relaxation and the map from inputs to the coefficient vector
+    of the objective, as build_problem of the scripts does.
+    """
+    import ncpol2sdpa as ncp
+    from ncpol2sdpa.nc_utils import simplify_polynomial
+
+    if any(set(family) - set('AB') for family in families):
+        raise ValueError("The decomposition has no operators of Eve, extra monomials "
+                         "can only contain A and B")
+    A = [Ax for Ax in ncp.generate_measurements(A_config, 'A')]
+    B = [By for By in ncp.generate_measurements(B_config, 'B')]
+    substitutions = ncp.projective_measurement_constraints(A, B)
+    profiling.lap('operators')
+    extra_monos = extra_monomials(families, A=A, B=B)
+    profiling.lap('extra_monos', extra_monos=len(extra_monos))
+
+    sdp = ncp.SdpRelaxation(ncp.flatten([A, B]), verbose=0, normalized=True, parallel=0)
+    with profiling.phase('get_relaxation') as counters:
+        sdp.get_relaxation(level=level, substitutions=substitutions, extramonomials=extra_monos)
+        counters.update(n_vars=sdp.n_vars, moment_matrix_size=sdp.block_struct[0],
+                        n_blocks=len(sdp.block_struct))
+
+    def facvar(polynomial):
+        # [constant term, coefficient of every moment] of a polynomial
+        polynomial = simplify_polynomial(polynomial, sdp.substitutions)
+        return np.array(sdp._get_facvar(polynomial), dtype=float)
+
+    # Guesses of Eve and the projector onto each of them
+    n_a, n_b = A_config[0], B_config[0]
+    if local:
+        guesses = list(range(n_a))
+
+        def guessed(e, x, *_):
+            return _outcome(A[x], e)
+    else:
+        guesses = list(product(range(n_a), range(n_b)))
+
+        def guessed(e, x, y):
+            return _outcome(A[x], e[0]) * _outcome(B[y], e[1])
+
+    # Every guess has the variables [q_e, moments of p_e], its moment matrix
+    # has q_e where the bare relaxation has its constant terms
+    width = sdp.n_vars + 1
+    n_guesses = len(guesses)
+    moments = csr_matrix(sdp.F)[:, :width]
+    weights = csr_matrix(([1.0] * n_guesses, ([0] * n_guesses, np.arange(n_guesses) * width)),
+                         shape=(1, n_guesses * width))
+    score_expr = np.tile(facvar(game.expression(A, B)), n_guesses)
+    rows = [
+        hstack([csr_matrix((moments.shape[0] * n_guesses, 1)), block_diag([moments] * n_guesses)]),
+        # sum_e q_e - 1 >= 0 and 1 - sum_e q_e >= 0
+        hstack([csr_matrix([[-1.0]]), weights]),
+        hstack([csr_matrix([[1.0]]), -weights]),
+        # score of sum_e p_e - score >= 0
+        csr_matrix(np.concatenate([[-score], score_expr])[None, :]),
+    ]
+    F = vstack(rows, format='csr')
+    block_struct = list(sdp.block_struct) * n_guesses + [1, 1, 1]
+    score_row = F.shape[0] - 1
+
+    objectives = []
+    for inp in inputs:
+        objective = np.zeros(F.shape[1])
+        for k, e in enumerate(guesses):
+            objective[1 + k * width:1 + (k + 1) * width] = facvar(guessed(e, *inp))
+        objectives.append(objective)
+    relaxation = CompiledRelaxation(F, block_struct, score_row, score, inputs, objectives)
+    return relaxation, relaxation.objective
@@ -0,0 +1,112 @@
+"""
+In this module we build whole entropy curves from few solves. The SDP solved
+for a score w has the value v(w) = -p_guess(w), which is convex in w, and the
+dual multiplier lam >= 0 of the score constraint of a solve at w0 is a
+subgradient of it. Every solve therefore gives the affine bound
+
+    p_guess(w) <= p_guess(w0) - lam (w - w0)
+
+for all scores w, and the minimum of the bounds of all solves is a concave,
+piecewise linear upper bound on the guessing probability, whose -log2 is a
+lower bound on the min-entropy at every score. A solve without a multiplier
+only bounds the scores above its own, as p_guess does not increase with w.
+
+As p_guess is concave, the chord between two solved scores lies below it, so
+the envelope is exact up to its gap to the chords. run_envelope_sweep only
+adds solves in the intervals where this gap exceeds a tolerance.
+"""
+
+import numpy as np
+
+from sweep import run_sweep, sweep_pool
+
+# Points per interval between two solved scores at which the gap between the
+# envelope and the chord is evaluated
+GAP_POINTS = 65
+
+
+def affine_bounds(solves, inputs):
+    """
+    The affine bounds of the solves keyed by (score, inputs) of every entry
+    of inputs, as arrays of rows (score, p_guess, multiplier) with nan for a
+    missing multiplier. Solves that are neither optimal nor inaccurate, as
+    solves close to the maximal score often are, are left out.
+    """
+    bounds = {}
+    for inp in inputs:
+        rows = [(score, -solve.dual, np.nan if solve.multiplier is None else solve.multiplier)
+                for (score, i), solve in solves.items()
+                if i == inp and solve.status in ('optimal', 'inaccurate')]
+        bounds[inp] = np.array(sorted(rows), dtype=float).reshape(-1, 3)
+    return bounds
+
+
+def guessing_bound(bounds, scores):
+    # The envelope of the affine bounds of one input at every score, never
+    # above the trivial bound 1
+    scores = np.asarray(scores, dtype=float)[:, None]
+    w0, p0, lam = bounds.T
+    affine = np.where(np.isnan(lam), np.where(scores >= w0, p0, np.inf),
+                      p0 - np.nan_to_num(lam) * (scores - w0))
+    return np.minimum(affine.min(axis=1, initial=np.inf), 1)
+
+
+def entropy_envelope(solves, inputs, scores):
+    """
+    The lower bound on the min-entropy at every score of scores, averaged
+    over inputs, given by the envelopes of the solves keyed by
+    (score, inputs).
+    """
+    bounds = affine_bounds(solves, inputs)
+    with np.errstate(divide='ignore'):
+        return np.mean([-np.log2(guessing_bound(bounds[inp], scores)) for inp in inputs],
+                       axis=0)
+
+
+def _gaps(solves, scores, inputs):
+    # For every interval between two solved scores the largest gap in bits
+    # between the envelope and the chords, averaged over inputs, and the
+    # score to solve next, where the gap is largest but at least an eighth
+    # of the interval away from its ends. Without the margin an end whose
+    # multiplier is missing would only be approached step by step.
+    bounds = affine_bounds(solves, inputs)
+    t = np.linspace(0, 1, GAP_POINTS)[1:-1]
+    gaps = []
+    for a, b in zip(scores, scores[1:]):
+        w = a + (b - a) * t
+        gap = 0
+        for inp in inputs:
+            pa, pb = -solves[(a, inp)].dual, -solves[(b, inp)].dual
+            chord = pa + (pb - pa) * t
+            gap = gap + np.log2(guessing_bound(bounds[inp], w) / chord) / len(inputs)
+        gaps.append((gap.max(), float(np.clip(w[gap.argmax()], a + (b - a) / 8, b - (b - a) / 8))))
+    return gaps
+
+
+def run_envelope_sweep(build_problem, low, high, inputs, tol=0.01, initial=3, max_points=40,
+                       min_step=1e-4, workers=1, solver_threads=1, **kwargs):
+    """
+    Solves scores on [low, high] until the entropy envelope averaged over
+    inputs is within tol bits of the chords between the solved scores, at
+    most max_points scores are used or no interval wider than min_step is
+    left to refine. Every round solves the score of the largest gap of every
+    interval whose gap exceeds tol. Further keyword arguments are passed on
+    to run_sweep. Returns the sorted scores and the solves keyed by
+    (score, inputs), from which entropy_envelope gives the curve.
+    """
+    scores = [low + (high - low) * i / (initial - 1) for i in range(initial)]
+    new = scores
+    solves = {}
+    pool = sweep_pool(build_problem, workers, solver_threads) if workers > 1 else None
+    try:
+        while new:
+            solves.update(run_sweep(build_problem, new, inputs, workers=workers,
+                                    solver_threads=solver_threads, pool=pool, **kwargs))
+            new = [w for (gap, w), a, b in zip(_gaps(solves, scores, inputs), scores, scores[1:])
+                   if gap > tol and b - a > min_step]
+            new = new[:max(0, max_points - len(scores))]
+            scores = sorted(scores + new)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return scores, solves
@@ -0,0 +1,80 @@
+"""
+In this module we climb the NPA hierarchy only where it matters. A sweep is
+first solved with a cheap relaxation, level 1 with the first family of extra
+monomials, and then again with the next relaxation of a ladder of steps
+(level, families of extra monomials). A score stops
+climbing as soon as its entropy bound changed by less than a tolerance between
+two steps, so the expensive relaxations are only built and solved for the
+scores whose bound has not converged yet.
+"""
+
+from functools import partial
+from math import isnan
+
+from adaptive import entropy_curve
+from sweep import run_sweep
+
+
+def escalation_steps(level, families):
+    # The families added one after the other at level 1, then the levels from
+    # 2 up to level without extra monomials, then the families added one
+    # after the other at the full level
+    cheap = [(1, list(families[:i])) for i in range(1, len(families) + 1)] if level > 1 else []
+    return cheap + [(lvl, []) for lvl in range(min(2, level), level + 1)] + \
+        [(level, list(families[:i])) for i in range(1, len(families) + 1)]
+
+
+def run_escalating_sweep(build_problem, steps, scores, inputs, entropy, tol=0.01,
+                         problem=None, **kwargs):
+    """
+    Solves every score at the steps of steps in order until the entropy
+    averaged over inputs changes by less than tol bits between two steps.
+    build_problem is called as build_problem(level, families) and otherwise
+    works as for run_sweep, entropy maps a solve to its entropy as ent() in the
+    scripts. The solves of every step are kept under the problem description
+    problem with the level and the extra monomials of the step. Further
+    keyword arguments are passed on to run_sweep.
+
+    A score whose solves at a step are not optimal or give no bound, see
+    adaptive.valid_entropy, cannot converge at that step and skips the other
+    steps at the same level, as more monomials rarely bound a relaxation
+    that is unbounded at its level. This is the case at level 1 unless the
+    operators W are projectors: the localizing matrices of the constraints
+    on W are then scalars, which leave <W_e W_e> unbounded. Bounds within
+    tol of 0 bits do not converge either, as the cheap steps give them far
+    from the classical score.
+
+    Returns the solves of the last step of every score keyed by
+    (score, inputs) and for every score the step it stopped at.
+    """
+    solves = {}
+    stopped = {}
+    previous = {}
+    active = list(scores)
+    # Level at which a score found no bound
+    unbounded = {}
+    for level, families in steps:
+        if not active:
+            break
+        families = list(families)
+        step_scores = [score for score in active if unbounded.get(score) != level]
+        if not step_scores:
+            continue
+        step_problem = None
+        if problem is not None:
+            step_problem = dict(problem, level=level, extra_monos=families)
+        new = run_sweep(partial(build_problem, level, families), step_scores, inputs,
+                        problem=step_problem, **kwargs)
+        curve = entropy_curve(new, step_scores, inputs, entropy)
+        converged = []
+        for score, h in zip(step_scores, curve):
+            solves.update(((score, inp), new[(score, inp)]) for inp in inputs)
+            stopped[score] = (level, families)
+            if isnan(h):
+                unbounded[score] = level
+                continue
+            if score in previous and abs(h - previous[score]) < tol and h >= tol:
+                converged.append(score)
+            previous[score] = h
+        active = [score for score in active if score not in converged]
+    return solves, stopped
@@ -0,0 +1,155 @@
+"""
+In this module we describe non-local games by a dense payoff tensor
+V[a, b, x, y] together with a distribution pi[x, y] over the inputs. The
+winning probability used as objective in the winprob scripts and as score
+constraint in the min-entropy scripts is built from this tensor in one pass,
+directly in terms of the projectors returned by ncp.generate_measurements.
+"""
+
+from itertools import permutations, product
+
+import numpy as np
+
+
+def _elimination(n):
+    # Writes the n projectors of a measurement in the basis
+    # [1, P_0, ..., P_{n-2}] used by ncp.generate_measurements, in which the
+    # last projector is eliminated as P_{n-1} = 1 - P_0 - ... - P_{n-2}
+    M = np.zeros((n, n))
+    M[:-1, 1:] = np.eye(n - 1)
+    M[-1, 0] = 1
+    M[-1, 1:] = -1
+    return M
+
+
+def _moments(p):
+    # The marginals pA[..., x, a] and pB[..., y, b] and the joint
+    # probabilities pAB[..., x, a, y, b] of all but the last outcomes
+    p = np.asarray(p, dtype=float)
+    if p.ndim < 4:
+        raise ValueError("The distributions need the axes a, b, x, y")
+    pA = p.sum(axis=-3).mean(axis=-1)[..., :-1, :]
+    pB = p.sum(axis=-4).mean(axis=-2)[..., :-1, :]
+    pAB = np.moveaxis(p[..., :-1, :-1, :, :], [-2, -4, -1, -3], [-4, -3, -2, -1])
+    return np.swapaxes(pA, -1, -2), np.swapaxes(pB, -1, -2), pAB
+
+
+def observed_moments(p):
+    """
+    The moments <A[x][a]>, <B[y][b]> and <A[x][a] B[y][b]> fixed by observed
+    distributions p[..., a, b, x, y], with any number of leading axes for a
+    batch of distributions. They are ordered as the statistic monomials
+    extra_monomials(['A', 'B', 'AB'], A=A, B=B) of the measurements of
+    ncp.generate_measurements, whose last outcomes are eliminated. The
+    marginals of a party are averaged over the input of the other one, which
+    removes the signalling shown by finite statistics.
+    """
+    pA, pB, pAB = _moments(p)
+    batch = pAB.shape[:-4]
+    return np.concatenate([pA.reshape(batch + (-1,)), pB.reshape(batch + (-1,)),
+                           pAB.reshape(batch + (-1,))], axis=-1)
+
+
+class Game:
+
+    def __init__(self, payoff, input_distribution=None):
+        self.payoff = np.asarray(payoff, dtype=float)
+        n_a, n_b, n_x, n_y = self.payoff.shape
+        if input_distribution is None:
+            input_distribution = np.full((n_x, n_y), 1 / (n_x * n_y))
+        self.input_distribution = np.asarray(input_distribution, dtype=float)
+
+    @classmethod
+    def from_predicate(cls, predicate, n_a, n_b, n_x, n_y, input_distribution=None):
+        payoff = np.zeros((n_a, n_b, n_x, n_y))
+        for a, b, x, y in product(range(n_a), range(n_b), range(n_x), range(n_y)):
+            payoff[a, b, x, y] = predicate(a, b, x, y)
+        return cls(payoff, input_distribution)
+
+    @property
+    def shape(self):
+        return self.payoff.shape
+
+    @property
+    def weights(self):
+        # pi(x, y) V(a, b, x, y), the coefficient of p(a, b|x, y) in the score
+        return self.payoff * self.input_distribution[None, None, :, :]
+
+    def coefficients(self):
+        # Coefficients C[x, y, k, l] of the score in the basis
+        # [1, A[x][0], ...] x [1, B[y][0], ...] of generate_measurements
+        n_a, n_b, _, _ = self.shape
+        return np.einsum('ak,abxy,bl->xykl', _elimination(n_a), self.weights, _elimination(n_b))
+
+    def score(self, p):
+        """
+        The winning probability of observed distributions p[..., a, b, x, y]
+        computed from their observed_moments, so that it agrees exactly with
+        the score expression on the moments the statistics fix.
+        """
+        if np.shape(p)[-4:] != self.shape:
+            raise ValueError("Expected distributions of shape %s" % (self.shape,))
+        C = self.coefficients()
+        pA, pB, pAB = _moments(p)
+        return (C[:, :, 0, 0].sum() +
+                np.einsum('xyk,...xk->...', C[:, :, 1:, 0], pA) +
+                np.einsum('xyl,...yl->...', C[:, :, 0, 1:], pB) +
+                np.einsum('xykl,...xkyl->...', C[:, :, 1:, 1:], pAB))
+
+    def expression(self, A, B):
+        """
+        The winning probability sum pi(x, y) V(a, b, x, y) p(a, b|x, y) as a
+        polynomial in the measurement operators A and B of
+        ncp.generate_measurements.
+        """
+        # sympy is only needed here, runs from compiled relaxations never load it
+        from sympy import Add
+
+        C = self.coefficients()
+        terms = [float(C[:, :, 0, 0].sum())]
+        for x, y, k, l in zip(*np.nonzero(C)):
+            if k == 0 and l == 0:
+                continue
+            a = A[x][k - 1] if k > 0 else 1
+            b = B[y][l - 1] if l > 0 else 1
+            terms.append(float(C[x, y, k, l]) * a * b)
+        return Add(*terms)
+
+
+def chsh():
+    # X = Y = A = B = {0, 1}, win if a + b = xy mod 2
+    a, b, x, y = np.ix_(range(2), range(2), range(2), range(2))
+    return Game((a ^ b) == x * y)
+
+
+def cglmp(d=3):
+    # X = Y = {0, 1}, A = B = {0, ..., d-1}
+    # Probabilistic winning function
+    #  w(a,b,x,y,) = [a-b = xy mod d] + 1/2 * [a-b = (-1)^{x \oplus y} + xy mod d]
+    a, b, x, y = np.ix_(range(d), range(d), range(2), range(2))
+    payoff = ((a - b) % d == (x * y) % d) + \
+        0.5 * ((a - b) % d == ((-1) ** (x ^ y) + x * y) % d)
+    return Game(payoff)
+
+
+def vazvid(k):
+    # VazVid_k / eCHSH_k
+    # X = Y = {0, 1}, A = B = {0, 1, ..., 2^k-1}
+    # For (x, y) = (0, 0) the outputs have to agree, otherwise the game is won
+    # depending on the relative Hamming distance of the bit strings a and b
+    a, b, x, y = np.ix_(range(2 ** k), range(2 ** k), range(2), range(2))
+    n_diff = np.vectorize(lambda n: bin(n).count('1'))(a ^ b)
+    payoff = np.where((x == 0) & (y == 0), a == b,
+                      np.where(y == 1, 100 * n_diff <= 16 * k,
+                               (49 * k <= 100 * n_diff) & (100 * n_diff <= 51 * k)))
+    return Game(payoff)
+
+
+def bit_permutations(k):
+    # The relabelings of the outcomes {0, ..., 2^k-1} of vazvid(k) induced by
+    # permuting the k bits. They leave the Hamming distance of two outcomes
+    # unchanged and fix the outcomes 0 and 2^k-1.
+    outcomes = np.arange(2 ** k)
+    bits = (outcomes[:, None] >> np.arange(k)) & 1
+    return [tuple(int(n) for n in bits[:, list(sigma)] @ (1 << np.arange(k)))
+            for sigma in permutations(range(k))]
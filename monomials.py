@@ -0,0 +1,92 @@
+"""
+In this module we generate the extra monomials of a relaxation from named
+families instead of nested loops in every script. A family is a string of
+party names, e.g. 'ABW' for all products a * b * w with one operator of each
+of the parties A, B and W. Only the families that are asked for are generated.
+
+Multiplying sympy operators one by one is slow, as every product is
+canonicalized again. The products are therefore generated as words of
+integer IDs, one row of an array per monomial, and only turned into sympy
+monomials at the end, directly from their factors. The commutation rules
+between the operators of different parties are built in the same way, as are
+the rules that make operators orthogonal projectors.
+"""
+
+from itertools import groupby
+
+import numpy as np
+
+
+def _encode(parties):
+    # The distinct operators of all parties in one list and for every party
+    # the IDs, i.e. the positions in that list, of its operators
+    positions, ids = {}, {}
+    for name, ops in parties.items():
+        ids[name] = np.array([positions.setdefault(op, len(positions)) for op in ops], dtype=int)
+    return list(positions), ids
+
+
+def words(*ids):
+    # All words with one ID of each of the arrays of IDs, one word per row in
+    # the order of itertools.product
+    grids = np.meshgrid(*ids, indexing='ij')
+    return np.stack([grid.ravel() for grid in grids], axis=1).reshape(-1, len(ids))
+
+
+def monomial(word, symbols):
+    # The product of the operators of a word as sympy would give it, equal
+    # neighbours become a power and all operators are noncommutative
+    # sympy is only needed here, runs from compiled relaxations never load it
+    from sympy import Mul, Pow
+
+    factors = []
+    for op, run in groupby(word):
+        n = len(list(run))
+        factors.append(symbols[op] if n == 1 else Pow(symbols[op], n))
+    if len(factors) == 1:
+        return factors[0]
+    return Mul._from_args(factors, is_commutative=False)
+
+
+def extra_monomials(families, **parties):
+    """
+    The monomials of all families, e.g.
+    extra_monomials(['ABW', 'AW'], A=A, B=B, W=W) for the measurements A and B
+    of ncp.generate_measurements and Eve's operators W. Nested lists of
+    operators are flattened.
+    """
+    import ncpol2sdpa as ncp
+
+    symbols, ids = _encode({name: ncp.flatten(ops) for name, ops in parties.items()})
+    monomials = []
+    for family in families:
+        monomials += [monomial(word, symbols)
+                      for word in words(*(ids[name] for name in family)).tolist()]
+    return monomials
+
+
+def commutation_rules(operators, others):
+    """
+    The substitutions {o * p: p * o} for every operator o of operators and p
+    of others, e.g. commutation_rules(W, [A, B]) for Eve's operators W that
+    commute with the measurements A and B. Nested lists of operators are
+    flattened.
+    """
+    import ncpol2sdpa as ncp
+
+    symbols, ids = _encode({'o': ncp.flatten(operators), 'p': ncp.flatten(others)})
+    return {monomial(word, symbols): monomial(word[::-1], symbols)
+            for word in words(ids['o'], ids['p']).tolist()}
+
+
+def projector_rules(operators):
+    """
+    The substitutions {o * o: o} and {o * p: 0} for all operators o != p of
+    operators, which makes them orthogonal projectors, e.g. for Eve's
+    operators W of a sparse relaxation, see RelaxationTemplate.sparsify.
+    """
+    import ncpol2sdpa as ncp
+
+    symbols, ids = _encode({'o': ncp.flatten(operators)})
+    return {monomial(word, symbols): symbols[word[0]] if word[0] == word[1] else 0
+            for word in words(ids['o'], ids['o']).tolist()}
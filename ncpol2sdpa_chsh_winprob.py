@@ -4,17 +4,30 @@ In this script we calculate the maximum CHSH win probability
 
 import ncpol2sdpa as ncp
 
+import games
+import profiling
+import solvers
+
 level = 2
-P = ncp.Probability([2, 2], [2, 2])
-# CHSH win probability
-CHSH_game = P([0, 0], [0, 0]) + P([1, 1], [0, 0]) + \
-            P([0, 0], [1, 0]) + P([1, 1], [1, 0]) + \
-            P([0, 0], [0, 1]) + P([1, 1], [0, 1]) + \
-            P([0, 1], [1, 1]) + P([1, 0], [1, 1])
-objective = -CHSH_game/4
-sdp = ncp.SdpRelaxation(P.get_all_operators())
-sdp.get_relaxation(level, objective=objective,
-                   substitutions=P.substitutions)
-sdp.solve('mosek')
-print(-sdp.primal)
-print(-sdp.dual)
+# 'auto' for MOSEK where it is licensed and a free solver otherwise
+SOLVER = 'auto'
+GAME = games.chsh()
+
+
+def build_relaxation(level):
+    P = ncp.Probability([2, 2], [2, 2])
+    profiling.lap('operators')
+    # CHSH win probability
+    objective = -GAME.expression(*P.parties)
+    profiling.lap('substitutions')
+    sdp = ncp.SdpRelaxation(P.get_all_operators())
+    with profiling.phase('get_relaxation'):
+        sdp.get_relaxation(level, objective=objective,
+                           substitutions=P.substitutions)
+    return sdp
+
+
+if __name__ == "__main__":
+    sdp = solvers.solve(build_relaxation(level), SOLVER)
+    print(-sdp.primal)
+    print(-sdp.dual)
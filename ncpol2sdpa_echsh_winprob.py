@@ -1,9 +1,14 @@
 import ncpol2sdpa as ncp
-from itertools import product
-import fractions
+
+import games
+import profiling
+import solvers
+from monomials import extra_monomials
 
 # Results:
 #  For k=2 just recover the CHSH win probability 0.5 + sqrt(2)/4
+#  For k=3 the pair (x, y) = (1, 0) can never be won and the others are won
+#  iff a = b, so the win probability is 3/4
 
 # number of parallel CHSH games
 k = 2
@@ -12,32 +17,34 @@ k = 2
 # X = Y = {0, 1}
 # A = {0, 1, ..., 2^k-1}
 # B = {0, 1, ..., 2^k-1}
-def game_func(a, b, x, y):
-    if x == 0 and y == 0:
-        return 1 if a == b else 0
-    # compute relative Hammond distance
-    a_bits = "{0:b}".format(a).rjust(k, "0")
-    b_bits = "{0:b}".format(b).rjust(k, "0")
-    n_diff = 0
-    for i in range(len(a_bits)):
-        n_diff += a_bits[i] != b_bits[i]
-    dist = fractions.Fraction(n_diff, k)
-    if y == 1:  # (B, 0)
-        return 1 if dist <= fractions.Fraction(16, 100) else 0
-    elif x == 1 and y == 0:
-        return 1 if dist >= fractions.Fraction(49, 100) and dist <= fractions.Fraction(51, 100) else 0
-    raise ValueError("Invalid x={x} and/or y={y}")
-
-level = 2
-P = ncp.Probability([2**k, 2**k], [2**k, 2**k])
-# VazVid_k win probability
-VazVid_game = 0
-for (a, b, x, y) in product(range(2**k), range(2**k), [0, 1], [0, 1]):
-    VazVid_game += game_func(a, b, x, y) * P([a, b], [x, y])
-objective = -VazVid_game / 4
-sdp = ncp.SdpRelaxation(P.get_all_operators(), verbose=0)
-sdp.get_relaxation(level, objective=objective,
-                   substitutions=P.substitutions)
-sdp.solve('mosek')
-print(-sdp.primal)
-print(-sdp.dual)
+
+
+def build_relaxation(k, level=2, extra_monos=()):
+    # NPA relaxation of the given level for the VazVid_k win probability
+    # together with the families of extra monomials of monomials.py, e.g.
+    # level 1 with ['AB'] for larger k
+    game = games.vazvid(k)
+    P = ncp.Probability([2**k, 2**k], [2**k, 2**k])
+    A, B = P.parties
+    profiling.lap('operators')
+    objective = -game.expression(A, B)
+    extra = extra_monomials(extra_monos, A=A, B=B)
+    profiling.lap('substitutions')
+    sdp = ncp.SdpRelaxation(P.get_all_operators(), verbose=0)
+    with profiling.phase('get_relaxation'):
+        sdp.get_relaxation(level, objective=objective,
+                           substitutions=P.substitutions,
+                           extramonomials=extra)
+    return sdp
+
+
+def max_score(k, level=2, extra_monos=(), solver='auto'):
+    # Upper bound on the VazVid_k win probability from build_relaxation
+    sdp = solvers.solve(build_relaxation(k, level, extra_monos), solver)
+    return -sdp.primal, -sdp.dual
+
+
+if __name__ == "__main__":
+    primal, dual = max_score(k)
+    print(primal)
+    print(dual)
@@ -0,0 +1,531 @@
+"""
+In this module we build and run min-entropy problems from declarative specs
+instead of from copies of the min-entropy scripts. A spec is a JSON, TOML or
+YAML mapping with the keys of DEFAULTS, of which game and scores are
+required, e.g. for the local min-entropy of CGLMP_3
+
+    {"game": {"name": "cglmp", "d": 3},
+     "objective": "H_min(A|E)",
+     "scores": {"low": 0.75, "high": 0.8643567588466105, "num": 12},
+     "solver": "scs", "solver_parameters": {"eps": 1e-6}}
+
+The relaxation is built exactly as in the scripts: the outcomes of Eve are
+guessed by the operators W, one per outcome of A for H_min(A|E) or per pair
+of outcomes of A and B for H_min(AB|E), which commute with the measurements
+and form a sub-normalized POVM. With the formulation 'decomposition' one
+moment matrix per guess of Eve is used instead, see decomposition.py. With
+the assembly 'streaming' the relaxation is written to disk in chunks instead
+of being built in memory by ncpol2sdpa, see assembly.py. The scores are swept with the same functions as in the scripts, and the solves
+are written to the result store under the problem description the scripts
+use, so results.py finds them as well. With statistics, a file of observed
+distributions, the entropy is conditioned on every distribution instead of a
+score.
+
+The min-entropy scripts are specs of this module as well, e.g.
+ncpol2sdpa_chsh_min_local.py, which run them with run_spec and report.
+
+Every spec given on the command line is run in turn, e.g.
+
+    python pipeline.py specs/*.json --store results/job_17.sqlite
+
+and with --compare in both formulations, whose entropies are printed side by
+side.
+"""
+
+import argparse
+import json
+import os
+from functools import partial
+from itertools import product
+from math import log2
+
+import numpy as np
+
+import games
+import profiling
+from adaptive import entropy_curve, run_adaptive_sweep, valid_entropy
+from assembly import assembled_problem
+from certificates import certified_entropy, round_down
+from compiled import cached_problem
+from decomposition import decomposed_problem
+from envelope import run_envelope_sweep
+from escalation import escalation_steps, run_escalating_sweep
+from monomials import commutation_rules, extra_monomials, projector_rules
+from store import RESULTS_DB, ResultStore, SolveLog, problem_hash
+from sweep import run_statistics_sweep, run_sweep
+
+# Keys of a spec and their defaults, game and scores are required, scores
+# not with statistics
+DEFAULTS = {
+    # Name of a game of games.py, optionally with its parameters as in
+    # {"name": "vazvid", "k": 2}, or {"payoff": V[a][b][x][y]} with an
+    # optional "input_distribution"
+    'game': None,
+    # Outcomes of every measurement as for ncp.generate_measurements, by
+    # default those of the game
+    'A_config': None,
+    'B_config': None,
+    # 'H_min(A|E)' or 'H_min(AB|E)'
+    'objective': 'H_min(A|E)',
+    # 'operators' for the operators W of Eve, 'decomposition' for one moment
+    # matrix per guess of Eve, see decomposition.py
+    'formulation': 'operators',
+    'level': 2,
+    # 'ncpol2sdpa' to build the relaxation in memory, 'streaming' to write it
+    # to disk in chunks without sympy, see assembly.py
+    'assembly': 'ncpol2sdpa',
+    # By default ['ABW', 'AW', 'BW'] for the operators W and none for the
+    # decomposition
+    'extra_monos': None,
+    # Families of monomials for the localizing matrices of the constraints on
+    # W, None for the default of ncpol2sdpa
+    'localizing_monos': None,
+    # Merge the moments related by permuting the bits of the outcomes, only
+    # valid for games that are invariant under it such as vazvid
+    'bit_symmetry': False,
+    # List of scores or {"low": ..., "high": ..., "num": ...}
+    'scores': None,
+    # By default every x for H_min(A|E) and every (x, y) for H_min(AB|E)
+    'inputs': None,
+    'symmetries': None,
+    'solver': 'auto',
+    'solver_parameters': None,
+    'workers': 1,
+    'solver_threads': 1,
+    # One of MODES, as ADAPTIVE, ENVELOPE and ESCALATE of the scripts
+    'mode': 'sweep',
+    'entropy_tol': 0.01,
+    'continuation': False,
+    # Solve the jobs in batches of relaxations stacked into one SDP, 'auto'
+    # or a number of jobs, see batching.py
+    'batch': None,
+    # Take the operators W as orthogonal projectors and split the moment
+    # matrix into about one block per guess, see relaxation.py
+    'sparse': False,
+    'cache': False,
+    # Log in logs/ to which every solve is written as soon as it finishes
+    'log': None,
+    # File (.npy) of observed distributions p[n, a, b, x, y], e.g. the
+    # statistics of experimental rounds, on which the entropy is conditioned
+    # instead of the scores
+    'statistics': None,
+}
+MODES = ('sweep', 'adaptive', 'envelope', 'escalate')
+OBJECTIVES = ('H_min(A|E)', 'H_min(AB|E)')
+FORMULATIONS = ('operators', 'decomposition')
+ASSEMBLIES = ('ncpol2sdpa', 'streaming')
+# Score at which a relaxation is built when the spec has none, the sweeps set
+# the score of every solve themselves
+BUILD_SCORE = 0.75
+# Directory of the relaxations assembled on disk, next to the scripts
+ASSEMBLY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assembled')
+GAMES = {
+    'chsh': games.chsh,
+    'cglmp': games.cglmp,
+    'vazvid': games.vazvid,
+}
+
+
+def ent(solve):
+    # Returns the entropy of the computed solution
+    return -1 * log2(-solve.dual)
+
+
+def _read(path):
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, 'rb') as f:
+        data = f.read()
+    if extension == '.json':
+        return json.loads(data)
+    if extension == '.toml':
+        try:
+            import tomllib
+        except ImportError:
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise ValueError("Reading %s needs Python 3.11 or tomli" % path)
+        return tomllib.loads(data.decode())
+    if extension in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError("Reading %s needs PyYAML" % path)
+        return yaml.safe_load(data)
+    raise ValueError("Unknown spec format %s, use .json, .toml or .yaml" % extension)
+
+
+def check_spec(spec):
+    """
+    Returns spec completed by DEFAULTS. Raises a ValueError for unknown or
+    missing keys and for values that cannot be run.
+    """
+    unknown = set(spec) - set(DEFAULTS)
+    if unknown:
+        raise ValueError("Unknown keys in spec: %s" % ", ".join(sorted(unknown)))
+    spec = dict(DEFAULTS, **spec)
+    required = ('game',) if spec['statistics'] is not None else ('game', 'scores')
+    missing = [key for key in required if spec[key] is None]
+    if missing:
+        raise ValueError("Missing keys in spec: %s" % ", ".join(missing))
+    if spec['objective'] not in OBJECTIVES:
+        raise ValueError("The objective has to be one of %s" % ", ".join(OBJECTIVES))
+    if spec['mode'] not in MODES:
+        raise ValueError("The mode has to be one of %s" % ", ".join(MODES))
+    if spec['formulation'] not in FORMULATIONS:
+        raise ValueError("The formulation has to be one of %s" % ", ".join(FORMULATIONS))
+    if spec['assembly'] not in ASSEMBLIES:
+        raise ValueError("The assembly has to be one of %s" % ", ".join(ASSEMBLIES))
+    if spec['extra_monos'] is None:
+        spec['extra_monos'] = ['ABW', 'AW', 'BW'] if spec['formulation'] == 'operators' else []
+    if spec['formulation'] == 'decomposition':
+        unsupported = ['localizing_monos'] if spec['localizing_monos'] is not None else []
+        unsupported += [key for key in ('sparse', 'bit_symmetry') if spec[key]]
+        if unsupported:
+            raise ValueError("The decomposition does not support %s" % ", ".join(unsupported))
+    if spec['assembly'] == 'streaming':
+        unsupported = ['sparse'] if spec['sparse'] else []
+        unsupported += ['the decomposition'] if spec['formulation'] != 'operators' else []
+        if unsupported:
+            raise ValueError("The streaming assembly does not support %s"
+                             % ", ".join(unsupported))
+    if not isinstance(spec['sparse'], bool):
+        raise ValueError("sparse has to be true or false")
+    if spec['batch'] not in (None, 'auto') and not (isinstance(spec['batch'], int)
+                                                    and spec['batch'] > 0):
+        raise ValueError("The batch has to be 'auto' or a positive number of jobs")
+    if spec['batch'] and spec['continuation']:
+        raise ValueError("Batches cannot be solved as continuations")
+    if spec['cache'] and spec['mode'] == 'escalate':
+        raise ValueError("The mode escalate builds a relaxation per step and cannot use the cache")
+    if spec['statistics'] is not None:
+        unsupported = ["the mode %s" % spec['mode']] if spec['mode'] != 'sweep' else []
+        if spec['formulation'] != 'operators':
+            unsupported.append("the decomposition")
+        if spec['assembly'] != 'ncpol2sdpa':
+            unsupported.append("the streaming assembly")
+        # Observed distributions are in general not invariant under relabelings
+        unsupported += [key for key in ('bit_symmetry', 'continuation') if spec[key]]
+        if unsupported:
+            raise ValueError("Statistics do not support %s" % ", ".join(unsupported))
+    game = make_game(spec['game'])
+    A_config, B_config = configs(spec, game)
+    if spec['bit_symmetry'] and (A_config[0] != B_config[0] or A_config[0] & (A_config[0] - 1)):
+        raise ValueError("Bit symmetry needs the same power of two of outcomes for A and B")
+    return spec
+
+
+def load_spec(path):
+    return check_spec(_read(path))
+
+
+def make_game(game):
+    if isinstance(game, str):
+        game = {'name': game}
+    if 'payoff' in game:
+        return games.Game(game['payoff'], game.get('input_distribution'))
+    params = {key: value for key, value in game.items() if key != 'name'}
+    if game.get('name') not in GAMES:
+        raise ValueError("Unknown game %s, use one of %s or give a payoff"
+                         % (game.get('name'), ", ".join(GAMES)))
+    return GAMES[game['name']](**params)
+
+
+def configs(spec, game):
+    # A_config and B_config of spec, which have to fit the game
+    n_a, n_b, n_x, n_y = game.shape
+    A_config = list(spec['A_config'] or [n_a] * n_x)
+    B_config = list(spec['B_config'] or [n_b] * n_y)
+    if A_config != [n_a] * n_x or B_config != [n_b] * n_y:
+        raise ValueError("A_config and B_config do not fit the game of shape %s"
+                         % (game.shape,))
+    return A_config, B_config
+
+
+def spec_scores(spec):
+    scores = spec['scores'] or []
+    if isinstance(scores, dict):
+        return [float(score) for score in np.linspace(scores['low'], scores['high'],
+                                                      scores['num'])]
+    return [float(score) for score in scores]
+
+
+def build_score(spec):
+    # The score a relaxation of spec is built at
+    scores = spec_scores(spec)
+    return scores[0] if scores else BUILD_SCORE
+
+
+def spec_inputs(spec):
+    if spec['inputs'] is not None:
+        return [tuple(inp) for inp in spec['inputs']]
+    _, _, n_x, n_y = make_game(spec['game']).shape
+    if spec['objective'] == 'H_min(A|E)':
+        return [(x,) for x in range(n_x)]
+    return list(product(range(n_x), range(n_y)))
+
+
+def problem_description(spec):
+    # The description by which the scripts find their solves in the store
+    game = make_game(spec['game'])
+    A_config, B_config = configs(spec, game)
+    problem = {
+        'game': game.payoff.tolist(),
+        'input_distribution': game.input_distribution.tolist(),
+        'A_config': A_config,
+        'B_config': B_config,
+        'objective': spec['objective'],
+        'level': spec['level'],
+        'extra_monos': list(spec['extra_monos']),
+    }
+    if spec['sparse']:
+        problem['sparse'] = True
+    if spec['statistics'] is not None:
+        problem['statistics'] = 'full'
+    if spec['localizing_monos'] is not None:
+        problem['localizing_monos'] = spec['localizing_monos']
+    if spec['formulation'] != 'operators':
+        problem['formulation'] = spec['formulation']
+    return problem
+
+
+def build_problem(spec, level=None, families=None):
+    # The relaxation of spec at the given level with the given families of
+    # extra monomials, by default those of the spec. partial(build_problem,
+    # spec) can be passed to run_sweep like build_problem of the scripts.
+    level = spec['level'] if level is None else level
+    families = spec['extra_monos'] if families is None else families
+    if spec['formulation'] == 'decomposition':
+        game = make_game(spec['game'])
+        return decomposed_problem(game, *configs(spec, game), spec['objective'] == 'H_min(A|E)',
+                                  level, build_score(spec), spec_inputs(spec), families)
+    if spec['assembly'] == 'streaming':
+        game = make_game(spec['game'])
+        score, inputs = build_score(spec), spec_inputs(spec)
+        # One directory per relaxation, with the score F holds and the inputs
+        # of the objectives
+        key = problem_hash(dict(problem_description(spec), level=level,
+                                extra_monos=list(families), score=score, inputs=inputs,
+                                bit_symmetry=spec['bit_symmetry']))
+        permutations = []
+        if spec['bit_symmetry']:
+            permutations = games.bit_permutations(game.shape[0].bit_length() - 1)[1:]
+        return assembled_problem(os.path.join(ASSEMBLY_DIR, key), game, *configs(spec, game),
+                                 spec['objective'] == 'H_min(A|E)', level, score, inputs,
+                                 families, spec['localizing_monos'], permutations)
+
+    # Imported here so that runs from a compiled relaxation never load
+    # ncpol2sdpa or sympy
+    import ncpol2sdpa as ncp
+    from sympy import S
+    from relaxation import RelaxationTemplate, measurement_relabeling
+
+    game = make_game(spec['game'])
+    A_config, B_config = configs(spec, game)
+    local = spec['objective'] == 'H_min(A|E)'
+    n_a, n_b = A_config[0], B_config[0]
+
+    # Measurement operators and one operator of Eve per guess
+    A = [Ax for Ax in ncp.generate_measurements(A_config, 'A')]
+    B = [By for By in ncp.generate_measurements(B_config, 'B')]
+    W = ncp.generate_operators('W', n_a if local else n_a * n_b, hermitian=True)
+    profiling.lap('operators')
+
+    substitutions = ncp.projective_measurement_constraints(A, B)
+    score_expr = game.expression(A, B)
+    # W commutes with the measurements
+    substitutions.update(commutation_rules(W, [A, B]))
+    if spec['sparse']:
+        substitutions.update(projector_rules(W))
+    # \sum W_e <= I_{R'} and W_e >= 0
+    operator_inequalities = [1 - sum(W)] + list(W)
+    if spec['localizing_monos'] is None:
+        localizing_monos = [None] * (len(W) + 2)
+    else:
+        monos = [S.One] + extra_monomials(spec['localizing_monos'], A=A, B=B, W=W)
+        localizing_monos = [monos] * (len(W) + 1) + [None]
+    profiling.lap('substitutions', substitutions=len(substitutions))
+
+    extra_monos = extra_monomials(families, A=A, B=B, W=W)
+    profiling.lap('extra_monos', extra_monos=len(extra_monos))
+    # Monomials whose moments are fixed by the observed distributions
+    statistics = None
+    if spec['statistics'] is not None:
+        statistics = extra_monomials(['A', 'B', 'AB'], A=A, B=B)
+
+    relabelings = []
+    if spec['bit_symmetry']:
+        k = n_a.bit_length() - 1
+        for permutation in games.bit_permutations(k)[1:]:
+            relabeling = measurement_relabeling(A + B, permutation)
+            if local:
+                relabeling.update((W[a], W[permutation[a]]) for a in range(n_a))
+            else:
+                relabeling.update((W[a * n_b + b], W[permutation[a] * n_b + permutation[b]])
+                                  for a in range(n_a) for b in range(n_b))
+            relabelings.append(relabeling)
+        profiling.lap('relabelings', relabelings=len(relabelings))
+
+    template = RelaxationTemplate(ncp.flatten([A, B, W]), level, score_expr,
+                                  build_score(spec), substitutions,
+                                  operator_inequalities=operator_inequalities,
+                                  extra_monos=extra_monos,
+                                  localizing_monos=localizing_monos,
+                                  relabelings=relabelings,
+                                  statistics=statistics)
+
+    def outcome(P, i):
+        # Projector of outcome i, the last one is eliminated
+        return P[i] if i < len(P) else 1 - sum(P)
+
+    # Objective function, the probability that Eve guesses correctly
+    if local:
+        def objective(x, *_):
+            return sum(outcome(A[x], a) * W[a] for a in range(n_a))
+    else:
+        def objective(x, y):
+            return sum(outcome(A[x], a) * outcome(B[y], b) * W[a * n_b + b]
+                       for a in range(n_a) for b in range(n_b))
+
+    if spec['sparse']:
+        with profiling.phase('sparsity'):
+            template.sparsify()
+
+    return template, objective
+
+
+def spec_build(spec):
+    # The function that run_spec passes to the sweeps to build the relaxation
+    build = partial(build_problem, spec)
+    if spec['cache']:
+        # The problem description leaves out how the relaxation is built
+        key = dict(problem_description(spec), bit_symmetry=spec['bit_symmetry'],
+                   assembly=spec['assembly'])
+        build = cached_problem(build, key, spec_inputs(spec))
+    return build
+
+
+def run_spec(spec, store=None, build=None):
+    """
+    Runs the sweep of spec as completed by check_spec and returns the scores
+    and the solves keyed by (score, inputs). The solves are written to store,
+    a ResultStore, if it is given. build replaces spec_build(spec), e.g. to
+    keep the relaxation between runs, except for the mode 'escalate', which
+    builds a relaxation per step.
+
+    With statistics the indices of the observed distributions take the place
+    of the scores, and the solves are not stored, as the distributions are
+    not part of the problem description.
+    """
+    scores = spec_scores(spec)
+    inputs = spec_inputs(spec)
+    problem = problem_description(spec)
+    if build is None:
+        build = spec_build(spec)
+    if spec['statistics'] is not None:
+        game = make_game(spec['game'])
+        distributions = np.reshape(np.load(spec['statistics']), (-1,) + game.shape)
+        solves = run_statistics_sweep(build, game, distributions, inputs,
+                                      workers=spec['workers'],
+                                      solver_threads=spec['solver_threads'],
+                                      solver=spec['solver'],
+                                      solver_parameters=spec['solver_parameters'],
+                                      batch=spec['batch'])
+        return list(range(len(distributions))), solves
+    symmetries = None
+    if spec['symmetries'] is not None:
+        symmetries = [[tuple(inp) for inp in group] for group in spec['symmetries']]
+    options = dict(workers=spec['workers'], solver_threads=spec['solver_threads'],
+                   solver=spec['solver'], solver_parameters=spec['solver_parameters'],
+                   store=store, log=SolveLog(spec['log']) if spec['log'] else None,
+                   problem=problem, symmetries=symmetries,
+                   continuation=spec['continuation'], batch=spec['batch'])
+    if spec['mode'] == 'escalate':
+        steps = escalation_steps(spec['level'], spec['extra_monos'])
+        solves, _ = run_escalating_sweep(partial(build_problem, spec), steps, scores, inputs,
+                                         ent, tol=spec['entropy_tol'], **options)
+    elif spec['mode'] == 'adaptive':
+        scores, solves = run_adaptive_sweep(build, scores[0], scores[-1], inputs, ent,
+                                            tol=spec['entropy_tol'], **options)
+    elif spec['mode'] == 'envelope':
+        scores, solves = run_envelope_sweep(build, scores[0], scores[-1], inputs,
+                                            tol=spec['entropy_tol'], **options)
+    else:
+        solves = run_sweep(build, scores, inputs, **options)
+    return scores, solves
+
+
+def report(spec, scores, solves):
+    """
+    Prints the solve of every score and inputs of spec with its entropy and
+    returns the entropies averaged over the inputs keyed by the score as a
+    string, as the scripts keep them. Solves that give no bound have the
+    entropy nan, see adaptive.valid_entropy.
+    """
+    inputs = spec_inputs(spec)
+    name = 'observed distribution' if spec['statistics'] is not None else 'score'
+    for score in scores:
+        for inp in inputs:
+            solve = solves[(score, inp)]
+            print(f"For the {name} {score} and inputs {inp} we find a dual of {solve.dual} "
+                  f"({solve.status}) and with that an entropy of {valid_entropy(solve, ent)}.")
+            if solve.iterations is not None:
+                print(f"  the solver needed {solve.iterations} iterations")
+            if solve.certified is not None:
+                print(f"  the certified entropy is at least "
+                      f"{round_down(certified_entropy(solve))}")
+    entropies = entropy_curve(solves, scores, inputs, ent)
+    return {str(score): [h] for score, h in zip(scores, entropies)}
+
+
+def run_and_report(spec, path=RESULTS_DB):
+    # Runs spec with the result store at path, as the scripts do, and prints
+    # its entropies
+    store = ResultStore(path)
+    try:
+        scores, solves = run_spec(spec, store)
+    finally:
+        store.close()
+    print(report(spec, scores, solves))
+
+
+def compare_formulations(spec, store=None):
+    """
+    Sweeps the scores of spec with every formulation, each with its default
+    extra monomials, and returns the scores and for every formulation the
+    entropies averaged over the inputs.
+    """
+    scores = spec_scores(spec)
+    entropies = {}
+    for formulation in FORMULATIONS:
+        other = check_spec(dict(spec, formulation=formulation, mode='sweep', extra_monos=None))
+        _, solves = run_spec(other, store)
+        entropies[formulation] = entropy_curve(solves, scores, spec_inputs(other), ent)
+    return scores, entropies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run min-entropy problems from specs")
+    parser.add_argument('specs', nargs='+', help="JSON, TOML or YAML specs")
+    parser.add_argument('--store', default=RESULTS_DB,
+                        help="SQLite result store the solves are written to")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="number of worker processes, overrides the specs")
+    parser.add_argument('--compare', action='store_true',
+                        help="run every spec in both formulations")
+    args = parser.parse_args()
+    specs = [load_spec(path) for path in args.specs]
+    store = ResultStore(args.store)
+    for path, spec in zip(args.specs, specs):
+        if args.workers is not None:
+            spec['workers'] = args.workers
+        if args.compare:
+            scores, entropies = compare_formulations(spec, store)
+            for i, score in enumerate(scores):
+                print(f"{path}: for a score {score} we find average entropies of "
+                      + ", ".join(f"{h[i]} ({formulation})" for formulation, h in entropies.items()))
+            continue
+        scores, solves = run_spec(spec, store)
+        for score, h in zip(scores, entropy_curve(solves, scores, spec_inputs(spec), ent)):
+            print(f"{path}: for a score {score} we find an average entropy of {h}")
+    store.close()
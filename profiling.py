@@ -0,0 +1,140 @@
+"""
+In this module we record how long the phases of building and solving a
+relaxation take and how much memory they need. Recording is switched off
+unless a benchmark runs the code inside record() or a trace is requested, so
+the scripts pay nothing for the markers.
+
+A phase either ends at a lap(name), which closes the phase that started at
+the end of the previous one, or is delimited by a with phase(name) block.
+Both can carry counters such as the number of substitutions.
+
+Setting the environment variable MINENTROPY_TRACE to a file name makes every
+build and every solve of a sweep append a JSON record with its score, inputs,
+sizes, phases and durations to that file, in the workers as well. With
+MINENTROPY_CAPTURE set to a comma separated list of 'cprofile' and
+'tracemalloc' each record also gets the hottest functions, with the full
+profile saved next to the trace, or the peak of the Python heap.
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Phases recorded so far and the end of the last one, None if not recording
+_phases = None
+_last = None
+# Number of traced blocks of this process, used to name profile dumps
+_traced = 0
+# Number of functions listed in the records of a cProfile capture
+HOT_FUNCTIONS = 15
+
+
+def peak_rss():
+    # Peak resident set size of this process in bytes, ru_maxrss is given in
+    # kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _add(name, tstart, counters):
+    global _last
+    _last = time.perf_counter()
+    _phases.append(dict(phase=name, wall_time=_last - tstart, peak_rss=peak_rss(), **counters))
+
+
+def lap(name, **counters):
+    if _phases is not None:
+        _add(name, _last, counters)
+
+
+@contextmanager
+def phase(name):
+    # Yields a dict to which counters of the phase can be added
+    counters = {}
+    if _phases is None:
+        yield counters
+        return
+    tstart = time.perf_counter()
+    try:
+        yield counters
+    finally:
+        _add(name, tstart, counters)
+
+
+@contextmanager
+def record():
+    """
+    Records the phases run inside the block into the list it yields. Every
+    entry holds the name of the phase, its wall time in seconds, the peak RSS
+    of the process at its end and its counters. The peak never decreases, so
+    the first phase with a large value is the one that needed the memory.
+    """
+    global _phases, _last
+    _phases, _last = [], time.perf_counter()
+    try:
+        yield _phases
+    finally:
+        _phases = _last = None
+
+
+def _hot_functions(profiler):
+    stats = pstats.Stats(profiler).stats
+    # Ranked by the time spent in the function itself, the cumulative time
+    # would only list the callers of the solver
+    hot = sorted(stats.items(), key=lambda item: -item[1][2])[:HOT_FUNCTIONS]
+    return [{'function': "%s:%d(%s)" % key, 'calls': calls, 'total_time': tt, 'cumulative_time': ct}
+            for key, (_, calls, tt, ct, _) in hot]
+
+
+@contextmanager
+def traced(**fields):
+    """
+    Appends a record with fields, the wall time, the phases run inside the
+    block and the captures of MINENTROPY_CAPTURE to the file named by
+    MINENTROPY_TRACE. Yields the record, so that results such as sizes or the
+    status can be added to it. Does nothing if MINENTROPY_TRACE is not set.
+    """
+    global _phases, _last, _traced
+    path = os.environ.get('MINENTROPY_TRACE')
+    if not path:
+        yield {}
+        return
+    capture = os.environ.get('MINENTROPY_CAPTURE', '').split(',')
+    _traced += 1
+    entry = dict(fields, pid=os.getpid(), time=time.time())
+    outer = _phases
+    _phases, _last = [], time.perf_counter()
+    profiler = cProfile.Profile() if 'cprofile' in capture else None
+    if 'tracemalloc' in capture:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    tstart = time.perf_counter()
+    try:
+        yield entry
+    finally:
+        entry['wall_time'] = time.perf_counter() - tstart
+        if profiler is not None:
+            profiler.disable()
+            entry['profile'] = "%s.%d.%d.prof" % (path, os.getpid(), _traced)
+            profiler.dump_stats(entry['profile'])
+            entry['hot_functions'] = _hot_functions(profiler)
+        if 'tracemalloc' in capture:
+            entry['tracemalloc_peak'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        entry['phases'] = _phases
+        entry['peak_rss'] = peak_rss()
+        # Phases of a traced block also belong to a surrounding record()
+        if outer is not None:
+            outer.extend(_phases)
+        _phases, _last = outer, time.perf_counter() if outer is not None else None
+        # One write per record, so that the lines of several workers do not
+        # interleave
+        with open(path, 'a') as f:
+            f.write(json.dumps(entry, default=float) + '\n')
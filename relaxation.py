@@ -0,0 +1,338 @@
+"""
+In this module we keep a single NPA relaxation around for a whole score sweep.
+Generating the moment matrix and the localizing matrices with ncpol2sdpa is by
+far the most expensive part of the min-entropy scripts, yet between two solves
+only the bound of the score constraint and the objective change. A
+RelaxationTemplate therefore builds the relaxation once and afterwards only
+edits the constant term of the score constraint and swaps the objective.
+
+For continuation along a score path, and for all solvers other than MOSEK, the
+template is solved through a parametrized cvxpy problem from solvers.py, which
+lets solvers such as SCS start from the solution of the previous score.
+
+Relabelings of the operators under which the whole problem is invariant can be
+given to the template. The moments of monomials that are mapped onto each
+other are then merged into a single SDP variable, which shrinks the problem
+the solver sees without changing its optimum.
+
+The moment matrix can also be split along its nonzero pattern. With the
+operators W of Eve taken as orthogonal projectors, which by Naimark's dilation
+does not change the guessing probability, the entries between monomials of
+different guesses vanish, and the maximal cliques of a chordal extension of
+the pattern hold the monomials of about one guess each. The blocks are
+principal submatrices of the moment matrix, so the split is a relaxation of
+the dense problem and every bound stays valid. Projective W alone already
+shrink the relaxation a lot, and where the overlapping blocks would cost the
+solver more than the whole matrix it is not split.
+
+Instead of a single score, the template can be conditioned on a whole observed
+distribution. The moments of the statistic monomials, see
+games.observed_moments, are then fixed by moment equalities whose constant
+terms are edited like the one of the score constraint, so one template serves
+any number of observed distributions.
+"""
+
+import heapq
+
+import numpy as np
+import ncpol2sdpa as ncp
+from ncpol2sdpa.nc_utils import simplify_polynomial
+from scipy.sparse import coo_matrix, vstack
+
+import certificates
+import profiling
+import solvers
+
+
+def measurement_relabeling(measurements, permutation):
+    """
+    Maps the projectors of every measurement in measurements, as returned by
+    ncp.generate_measurements, to the projectors of the permuted outcomes. The
+    last outcome is eliminated by generate_measurements, so the permutation
+    has to fix it.
+    """
+    n = len(permutation)
+    if permutation[n - 1] != n - 1:
+        raise ValueError("The permutation has to fix the last outcome")
+    return {P[i]: P[permutation[i]] for P in measurements for i in range(n - 1)}
+
+
+def chordal_cliques(n, edges):
+    """
+    The maximal cliques of a chordal extension of the graph on range(n) with
+    the given edges, found by eliminating the vertices in the order of
+    minimum degree. Every vertex is in at least one clique.
+    """
+    adjacency = [set() for _ in range(n)]
+    for i, j in edges:
+        adjacency[i].add(j)
+        adjacency[j].add(i)
+    heap = [(len(adjacency[v]), v) for v in range(n)]
+    heapq.heapify(heap)
+    position = {}
+    candidates = []
+    while heap:
+        degree, v = heapq.heappop(heap)
+        if v in position or degree != len(adjacency[v]):
+            continue
+        clique = [v] + sorted(adjacency[v])
+        candidates.append(clique)
+        if degree == n - len(position) - 1:
+            # Every remaining vertex has at least this degree, so the rest of
+            # the graph is complete and forms the last clique
+            for u in clique:
+                position[u] = len(candidates) - 1
+            break
+        position[v] = len(candidates) - 1
+        for u in adjacency[v]:
+            adjacency[u].discard(v)
+            adjacency[u] |= adjacency[v] - {u}
+            heapq.heappush(heap, (len(adjacency[u]), u))
+    # The clique of a vertex is contained in another one exactly if it is one
+    # vertex smaller than the clique of a vertex whose first later neighbour
+    # in the elimination order it is
+    maximal = [True] * len(candidates)
+    for index, clique in enumerate(candidates[:-1]):
+        if len(clique) > 1:
+            parent = position[min(clique[1:], key=position.get)]
+            if len(candidates[parent]) == len(clique) - 1:
+                maximal[parent] = False
+    return [sorted(clique) for clique, keep in zip(candidates, maximal) if keep]
+
+
+class RelaxationTemplate:
+
+    def __init__(self, ops, level, score_expr, score, substitutions,
+                 operator_equalities=None, operator_inequalities=None,
+                 moment_equalities=None, moment_inequalities=None,
+                 extra_monos=None, localizing_monos=None, relabelings=None,
+                 statistics=None, verbose=0):
+        # The score constraint score_expr - score >= 0 is added as the last
+        # moment inequality, so localizing_monos has to contain an entry for it
+        self.score = score
+        self.score_con = score_expr - score
+        moment_inequalities = (moment_inequalities or [])[:] + [self.score_con]
+        # The moments of the monomials of statistics are fixed by moment
+        # equalities, set to the observed values by set_statistics
+        statistics = list(statistics or [])
+        if statistics and relabelings:
+            raise ValueError("Relabelings only keep the optimum if the observed "
+                             "statistics are invariant as well")
+        moment_equalities = (moment_equalities or [])[:] + statistics
+
+        self.sdp = ncp.SdpRelaxation(ops, verbose=verbose, normalized=True, parallel=0)
+        with profiling.phase('get_relaxation') as counters:
+            self.sdp.get_relaxation(level=level,
+                                    equalities=operator_equalities,
+                                    inequalities=operator_inequalities,
+                                    momentequalities=moment_equalities,
+                                    momentinequalities=moment_inequalities,
+                                    objective=None,
+                                    substitutions=substitutions,
+                                    extramonomials=extra_monos,
+                                    localizing_monomials=localizing_monos)
+            counters.update(n_vars=self.sdp.n_vars, moment_matrix_size=self.sdp.block_struct[0],
+                            n_blocks=len(self.sdp.block_struct))
+
+        # Moment inequalities are 1x1 blocks, so the score constraint lives in
+        # a single row of F whose first column holds its constant term
+        block = self.sdp._constraint_to_block_index[self.score_con][0]
+        self.score_row = sum(bs ** 2 for bs in self.sdp.block_struct[:block])
+        # Every moment equality is a pair of 1x1 blocks for m >= 0 and -m >= 0,
+        # statistic_rows holds the row of the first one
+        starts = np.cumsum([0] + [bs ** 2 for bs in self.sdp.block_struct])
+        self.statistic_rows = np.array(
+            [starts[self.sdp._constraint_to_block_index[m][0]] for m in statistics], dtype=int)
+        self.statistics = np.zeros(len(statistics))
+        # Solver iterations of the last solve, if the solver reports them,
+        # the dual multiplier of the score constraint and the certified
+        # bound on the optimum, see certificates.py
+        self.iterations = None
+        self.multiplier = None
+        self.certified = None
+        self._cvx = None
+        # Map of the moments of the relaxation to the merged SDP variables
+        self._orbits = None
+        # SDP variables kept by sparsify
+        self._support = None
+        if relabelings:
+            with profiling.phase('symmetry') as counters:
+                self._merge_orbits(relabelings)
+                counters.update(n_vars=self.sdp.n_vars)
+
+    def _merge_orbits(self, relabelings):
+        # Every relabeling maps a feasible moment vector to a feasible one
+        # with the same objective value, so averaging over the group they
+        # generate keeps the optimum. All moments of an orbit can therefore be
+        # taken equal. The orbits are collected with a union-find.
+        n_vars = self.sdp.n_vars
+        parent = list(range(n_vars + 1))
+        # The relabelings and the identity are usually the whole group, so
+        # relabeling one moment of an orbit reaches all others. Only moments
+        # not reached yet are relabeled, otherwise xreplace dominates.
+        reached = np.zeros(n_vars + 1, dtype=bool)
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        index = self.sdp.monomial_index
+        for monomial, k in index.items():
+            if reached[k]:
+                continue
+            reached[k] = True
+            for relabeling in relabelings:
+                relabeled = monomial.xreplace(relabeling)
+                # Relabelings keep the order of the factors, so the image is
+                # usually found without applying the substitutions again
+                if relabeled in index:
+                    image = [(index[relabeled], 1)]
+                else:
+                    image = self.sdp._get_index_of_monomial(relabeled)
+                if len(image) != 1 or image[0][1] != 1:
+                    raise ValueError("The relabeling does not map the monomial %s "
+                                     "onto a moment of the relaxation" % monomial)
+                reached[image[0][0]] = True
+                parent[find(k)] = find(image[0][0])
+
+        roots = {}
+        orbit = [roots.setdefault(find(k), len(roots)) for k in range(n_vars + 1)]
+        self._orbits = coo_matrix((np.ones(n_vars + 1), (range(n_vars + 1), orbit)),
+                                  shape=(n_vars + 1, len(roots))).tocsr()
+        # F may have spare columns beyond the last moment
+        self.sdp.F = (self.sdp.F.tocsr()[:, :n_vars + 1] @ self._orbits).tolil()
+        self.sdp.n_vars = len(roots) - 1
+
+    def sparsify(self):
+        """
+        Splits the moment matrix into its principal submatrices on the
+        maximal cliques of a chordal extension of its nonzero pattern. The
+        cliques overlap, so the moment matrix is only split if the sum of the
+        cubes of their sizes, the cost of a solver iteration, is below the
+        cube of its size. Returns whether it was split. Has to be called
+        before the first solve.
+        """
+        F = self.sdp.F.tocsr()
+        bs = self.sdp.block_struct[0]
+        moment, rest = F[:bs ** 2], F[bs ** 2:]
+        # Entries of the upper triangle that are not identically zero are the
+        # edges of the pattern
+        upper = np.transpose(np.triu_indices(bs, 1))
+        nonzero = np.diff(moment.indptr) > 0
+        cliques = chordal_cliques(bs, upper[nonzero[upper[:, 0] * bs + upper[:, 1]]])
+        if sum(len(c) ** 3 for c in cliques) >= bs ** 3:
+            return False
+
+        # Every clique becomes a block holding the upper triangle of its
+        # principal submatrix
+        new_rows, old_rows, offset = [], [], 0
+        for c in cliques:
+            c = np.array(c)
+            i, j = np.triu_indices(len(c))
+            new_rows.append(offset + i * len(c) + j)
+            old_rows.append(c[i] * bs + c[j])
+            offset += len(c) ** 2
+        new_rows, old_rows = np.concatenate(new_rows), np.concatenate(old_rows)
+        select = coo_matrix((np.ones(len(new_rows)), (new_rows, old_rows)),
+                            shape=(offset, bs ** 2)).tocsr()
+        self.sdp.F = vstack([select @ moment, rest]).tolil()
+        # The moments left in the problem, objectives may only use these
+        support = np.zeros(F.shape[1], dtype=bool)
+        support[self.sdp.F.tocsr().indices] = True
+        support[0] = True
+        self.sdp.block_struct = [len(c) for c in cliques] + list(self.sdp.block_struct[1:])
+        if hasattr(self.sdp, 'constraint_starting_block'):
+            self.sdp.constraint_starting_block += len(cliques) - 1
+        self.score_row += offset - bs ** 2
+        self.statistic_rows += offset - bs ** 2
+        self._support = support
+        self._cvx = None
+        return True
+
+    def set_score(self, score):
+        # Only the constant term of score_expr - score >= 0 depends on the score
+        self.sdp.F[self.score_row, 0] += self.score - score
+        self.score = score
+        self.sdp.status = "unsolved"
+
+    def set_statistics(self, values):
+        # Only the constant terms of the pairs m - value >= 0 and
+        # value - m >= 0 depend on the observed values
+        values = np.asarray(values, dtype=float)
+        if values.shape != self.statistics.shape:
+            raise ValueError("Expected %d observed values, got %s"
+                             % (len(self.statistics), values.shape))
+        change = self.statistics - values
+        for row, delta in zip(self.statistic_rows, change):
+            self.sdp.F[row, 0] += delta
+            self.sdp.F[row + 1, 0] -= delta
+        self.statistics = values
+        self.sdp.status = "unsolved"
+
+    def constant_terms(self):
+        # The constant terms of all rows of F at the current score and
+        # statistics
+        return self.sdp.F[:, 0].toarray().ravel()
+
+    def objective_key(self, objective):
+        # The coefficients with which the objective enters the SDP, objectives
+        # with equal keys give the same problem
+        return tuple(round(float(c), 12) for c in self._facvar(objective))
+
+    def _facvar(self, polynomial):
+        polynomial = simplify_polynomial(polynomial, self.sdp.substitutions)
+        if self._orbits is None:
+            return self.sdp._get_facvar(polynomial)
+        # _get_facvar indexes the moments of the relaxation, which are summed
+        # up into their orbits afterwards
+        n_vars, self.sdp.n_vars = self.sdp.n_vars, self._orbits.shape[0] - 1
+        try:
+            facvar = self.sdp._get_facvar(polynomial)
+        finally:
+            self.sdp.n_vars = n_vars
+        return self._orbits.T @ np.array(facvar, dtype=float)
+
+    def set_objective(self, objective):
+        if self._support is not None:
+            dropped = np.flatnonzero(self._facvar(objective))
+            if not self._support[dropped].all():
+                raise ValueError("The objective uses moments that sparsify dropped")
+        if self._orbits is None:
+            self.sdp.set_objective(objective)
+        else:
+            facvar = self._facvar(objective)
+            self.sdp.obj_facvar = facvar[1:]
+            self.sdp.constant_term = facvar[0]
+        self.sdp.status = "unsolved"
+
+    def solve(self, objective, solver='mosek', solverparameters=None, warm_start=False):
+        # Returns the underlying relaxation so that its primal and dual can be
+        # read off exactly as for a freshly built ncp.SdpRelaxation. Solvers
+        # other than MOSEK and warm started solves go through a cvxpy problem
+        # that is built once and kept with the template.
+        self.set_objective(objective)
+        with profiling.phase('solve'):
+            self._solve(solver, solverparameters, warm_start)
+        self.multiplier = solvers.row_dual(self.sdp, self.score_row)
+        with profiling.phase('certify'):
+            self.certified = certificates.certify(self.sdp)
+        return self.sdp
+
+    def _solve(self, solver, solverparameters, warm_start):
+        if solver == 'mosek' and not warm_start:
+            self.sdp.solve(solver, solverparameters=solverparameters)
+            self.sdp.status = solvers.normalize_status(self.sdp.status)
+            self.iterations = None
+        else:
+            if self._cvx is None:
+                self._cvx = solvers.cvxpy_problem(self.sdp)
+            # The score constraint and the statistics are 1x1 blocks, so their
+            # constant terms are the only ones that change between solves
+            base = self._cvx[3]
+            rows = np.concatenate([[self.score_row], self.statistic_rows,
+                                   self.statistic_rows + 1])
+            base[rows] = self.sdp.F[rows, 0].toarray().ravel()
+            self.iterations = solvers.solve_cvxpy(self.sdp, solver, solverparameters,
+                                                  self._cvx, warm_start)
@@ -2,43 +2,157 @@ from math import sqrt
 
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
+import numpy as np
 from scipy.stats import entropy
 
+import ncpol2sdpa_cglmp_3_min_local as cglmp_3_min_local
+import ncpol2sdpa_chsh_min as chsh_min
+import ncpol2sdpa_chsh_min_local as chsh_min_local
+import ncpol2sdpa_echsh_min_local as echsh_min_local
+import solvers
+from certificates import certified_entropy
+from envelope import entropy_envelope
+from store import ResultStore
+
+
+# Entropies of the thesis by script, drawn for the scripts whose solves are
+# not in the result store, e.g. on a fresh clone
+THESIS_ENTROPIES = {
+    'ncpol2sdpa_chsh_min': {
+        '0.75': [5.364178620785489e-09], '0.76': [0.03351186500978613],
+        '0.77': [0.0732431789849653], '0.78': [0.11871745961231302],
+        '0.79': [0.17091135494736448], '0.8': [0.23129953462909042],
+        '0.805': [0.2652622107464345], '0.81': [0.30226806580240667],
+        '0.815': [0.3428757955108997], '0.82': [0.3878425023544511],
+        '0.825': [0.43823252399993545], '0.83': [0.49562245193907073],
+        '0.835': [0.5625231349300338], '0.84': [0.6433537160372045],
+        '0.845': [0.7474134095392008], '0.85': [0.902766883413926],
+        '0.8535533905932737': [1.2280672521048372]},
+    'ncpol2sdpa_chsh_min_local': {
+        '0.75': [4.736578431240713e-09], '0.76': [0.030374687513070642],
+        '0.77': [0.06415028547758023], '0.78': [0.10199960647159066],
+        '0.79': [0.14484749545721354], '0.8': [0.19402122528358917],
+        '0.805': [0.22157083859643106], '0.81': [0.2515387105898424],
+        '0.815': [0.2843843521656115], '0.82': [0.3207276198225399],
+        '0.825': [0.36143815333710216], '0.83': [0.40780073230425873],
+        '0.835': [0.461853032244506], '0.84': [0.5271852906084178],
+        '0.845': [0.6113226569866042], '0.85': [0.7369655033151004],
+        '0.8535533905932737': [0.9997243499206518]},
+    'ncpol2sdpa_cglmp_3_min_local': {
+        '0.75': [-7.991858783275906e-10], '0.76': [0.03041865821532462],
+        '0.77': [0.0674501062337608], '0.78': [0.11056454281956948],
+        '0.79': [0.1602725246698503], '0.8': [0.2177397784295937],
+        '0.805': [0.2499493775661259], '0.81': [0.2848964203947455],
+        '0.815': [0.32299873401514967], '0.82': [0.36479429361331517],
+        '0.825': [0.4109931831373559], '0.83': [0.4625612865027591],
+        '0.835': [0.5208608306635041], '0.84': [0.5879114966044465],
+        '0.845': [0.6669169508008348], '0.85': [0.7634852748041835],
+        '0.86': [1.0769211981590643], '0.8643567588466105': [1.5837128088186747]},
+    # For k = 2, the thesis summed the entropies of both inputs
+    'ncpol2sdpa_echsh_min_local': dict((w, [e[0] / 2]) for w, e in {
+        '0.75': [3.088883184243907e-10], '0.8': [0.3880419793037799],
+        '0.81': [0.5030767117733151], '0.82': [0.6414543513465181],
+        '0.83': [0.8156003064239574], '0.84': [1.054367346289726],
+        '0.85': [1.4739298818965756],
+        '0.8535533905932737': [1.9971284232041318]}.items()),
+}
+
+
+def _solver_rank(label):
+    # Position of the solver of a label in solvers.FALLBACK, the most
+    # accurate solver first
+    name = label.split('{')[0]
+    return solvers.FALLBACK.index(name) if name in solvers.FALLBACK else len(solvers.FALLBACK)
+
+
+def _stored_solves(script, solver=None):
+    # By default the solves of the most accurate solver in the store, of the
+    # labels of that solver the one with the most solves. The solver the
+    # script resolves to on this host may not be the one that solved it, e.g.
+    # on a node with a MOSEK license.
+    store = ResultStore()
+    if solver is None:
+        counts = store.solver_counts(script.PROBLEM)
+        if not counts:
+            return {}
+        solver = min(counts, key=lambda label: (_solver_rank(label), -counts[label]))
+    return store.solves(script.PROBLEM, solver)
+
+
+def _entropy(script, solve):
+    # The certified entropy of a solve, see certificates.py, and the entropy
+    # of its reported dual for solves stored without a certificate
+    h = certified_entropy(solve)
+    return script.ent(solve) if h is None else h
+
+
+def _thesis_entropies(script):
+    if script.__name__ == 'ncpol2sdpa_echsh_min_local' and script.k != 2:
+        return None
+    return THESIS_ENTROPIES.get(script.__name__)
+
+
+def load_entropies(script, solver=None):
+    # Averages the entropies over the inputs of every score for which the
+    # result store holds the solves of all inputs of the script. Without any
+    # such score, the entropies of the thesis are returned if there are some
+    # for the script.
+    solves = _stored_solves(script, solver)
+    results = {}
+    for score in sorted(set(score for score, _ in solves)):
+        if all((score, inputs) in solves for inputs in script.INPUTS):
+            results[str(score)] = [
+                sum(_entropy(script, solves[(score, inputs)]) for inputs in script.INPUTS)
+                / len(script.INPUTS)
+            ]
+    if not results:
+        thesis = _thesis_entropies(script)
+        if thesis is None:
+            raise ValueError("The result store holds no solves of %s, run it first"
+                             % script.__name__)
+        print(f"The result store holds no solves of {script.__name__}, "
+              f"drawing the entropies of the thesis")
+        results = thesis
+    return results
+
+
+def load_envelope(script, solver=None, points=200):
+    # The lower bound on the entropy given by the dual multipliers of all
+    # stored solves of the script, see envelope.py, at points scores between
+    # the smallest and the largest stored score. None if the store holds no
+    # solves of the script.
+    solves = _stored_solves(script, solver)
+    if not solves:
+        return None
+    scores = [score for score, _ in solves]
+    w = np.linspace(min(scores), max(scores), points)
+    return w, entropy_envelope(solves, script.INPUTS, w)
+
+
+def _plot_envelope(ax, script, style):
+    envelope = load_envelope(script)
+    if envelope is not None:
+        ax.plot(*envelope, style, linewidth=0.8)
+
 
 def draw_chsh():
-    chsh = {'0.75': [5.364178620785489e-09], '0.76': [0.03351186500978613],
-            '0.77': [0.0732431789849653], '0.78': [0.11871745961231302],
-            '0.79': [0.17091135494736448], '0.8': [0.23129953462909042],
-            '0.805': [0.2652622107464345], '0.81': [0.30226806580240667],
-            '0.815': [0.3428757955108997], '0.82': [0.3878425023544511],
-            '0.825': [0.43823252399993545], '0.83': [0.49562245193907073],
-            '0.835': [0.5625231349300338], '0.84': [0.6433537160372045],
-            '0.845': [0.7474134095392008], '0.85': [0.902766883413926],
-            '0.8535533905932737': [1.2280672521048372]}
-    chsh_local = {'0.75': [4.736578431240713e-09], '0.76': [0.030374687513070642],
-                  '0.77': [0.06415028547758023], '0.78': [0.10199960647159066],
-                  '0.79': [0.14484749545721354], '0.8': [0.19402122528358917],
-                  '0.805': [0.22157083859643106], '0.81': [0.2515387105898424],
-                  '0.815': [0.2843843521656115], '0.82': [0.3207276198225399],
-                  '0.825': [0.36143815333710216], '0.83': [0.40780073230425873],
-                  '0.835': [0.461853032244506], '0.84': [0.5271852906084178],
-                  '0.845': [0.6113226569866042], '0.85': [0.7369655033151004],
-                  '0.8535533905932737': [0.9997243499206518]}
-    chsh_analytic = {'0.75': [], '0.76': [], '0.77': [], '0.78': [], '0.79': [], '0.8': [],
-                     '0.805': [], '0.81': [], '0.815': [], '0.82': [], '0.825': [], '0.83': [],
-                     '0.835': [], '0.84': [], '0.845': [], '0.85': [], '0.8535533905932737': []}
-    for k in chsh_analytic.keys():
+    chsh = load_entropies(chsh_min)
+    chsh_local = load_entropies(chsh_min_local)
+    chsh_analytic = {}
+    for k in chsh.keys():
         chsh_analytic[k] = 1 - entropy([
             1 / 2 + 1 / 2 * (sqrt(16 * float(k) * (float(k) - 1) + 3)),
             1 - (1 / 2 + 1 / 2 * (sqrt(16 * float(k) * (float(k) - 1) + 3)))
         ], base=2)
 
     fig, ax = plt.subplots()
-    ax.plot([k for k in chsh.keys()], [v[0] for v in chsh.values()], "b.",
+    ax.plot([float(k) for k in chsh.keys()], [v[0] for v in chsh.values()], "b.",
             label=r"$H_\mathrm{min}(AB|E)$")
-    ax.plot([k for k in chsh_local.keys()], [v[0] for v in chsh_local.values()], "g.",
+    _plot_envelope(ax, chsh_min, "b-")
+    ax.plot([float(k) for k in chsh_local.keys()], [v[0] for v in chsh_local.values()], "g.",
             label=r"$H_\mathrm{min}(A|E)$")
-    ax.plot([k for k in chsh_analytic.keys()], [v for v in chsh_analytic.values()], "r.",
+    _plot_envelope(ax, chsh_min_local, "g-")
+    ax.plot([float(k) for k in chsh_analytic.keys()], [v for v in chsh_analytic.values()], "r.",
             label=r"$H(A|E)$ analytic")
     ax.legend()
     ax.xaxis.set_major_locator(ticker.MaxNLocator(8))
@@ -53,19 +167,12 @@ def draw_chsh():
 
 
 def draw_cglmp_3():
-    cglmp_local = {'0.75': [-7.991858783275906e-10], '0.76': [0.03041865821532462],
-                   '0.77': [0.0674501062337608], '0.78': [0.11056454281956948],
-                   '0.79': [0.1602725246698503], '0.8': [0.2177397784295937],
-                   '0.805': [0.2499493775661259], '0.81': [0.2848964203947455],
-                   '0.815': [0.32299873401514967], '0.82': [0.36479429361331517],
-                   '0.825': [0.4109931831373559], '0.83': [0.4625612865027591],
-                   '0.835': [0.5208608306635041], '0.84': [0.5879114966044465],
-                   '0.845': [0.6669169508008348], '0.85': [0.7634852748041835],
-                   '0.86': [1.0769211981590643], '0.8643567588466105': [1.5837128088186747]}
+    cglmp_local = load_entropies(cglmp_3_min_local)
 
     fig, ax = plt.subplots()
-    ax.plot([k for k in cglmp_local.keys()], [v[0] for v in cglmp_local.values()], "r.",
+    ax.plot([float(k) for k in cglmp_local.keys()], [v[0] for v in cglmp_local.values()], "r.",
             label=r"$H_\mathrm{min}(A|E)$")
+    _plot_envelope(ax, cglmp_3_min_local, "r-")
     ax.legend()
     ax.xaxis.set_major_locator(ticker.MaxNLocator(8))
     plt.xlabel("CGLMP win probability")
@@ -79,17 +186,12 @@ def draw_cglmp_3():
     )
 
 def draw_vazvid_2():
-    vazvid_local = dict((w, e[0]/2) for w, e in {
-        '0.75': [3.088883184243907e-10], '0.8': [0.3880419793037799], 
-        '0.81': [0.5030767117733151], '0.82': [0.6414543513465181], 
-        '0.83': [0.8156003064239574], '0.84': [1.054367346289726], 
-        '0.85': [1.4739298818965756], 
-        '0.8535533905932737': [1.9971284232041318]
-    }.items())
+    vazvid_local = dict((w, e[0]) for w, e in load_entropies(echsh_min_local).items())
 
     fig, ax = plt.subplots()
-    ax.plot([k for k in vazvid_local.keys()], [v for v in vazvid_local.values()], "r.",
+    ax.plot([float(k) for k in vazvid_local.keys()], [v for v in vazvid_local.values()], "r.",
             label=r"$H_\mathrm{min}(A|E)$")
+    _plot_envelope(ax, echsh_min_local, "r-")
     ax.legend()
     ax.xaxis.set_major_locator(ticker.MaxNLocator(7))
     plt.xlabel(r"$\mathrm{eCHSH}_2$ win probability")
@@ -0,0 +1,220 @@
+"""
+In this module we hide the differences between the SDP solvers the scripts can
+use. MOSEK is called through ncpol2sdpa as before, every other solver (CVXOPT,
+SCS or anything else cvxpy has installed) through a cvxpy problem built from
+the relaxation. After a solve the relaxation holds primal, dual, status and
+solution_time in the same form whichever solver was used. Through cvxpy the
+dual is the dual objective at the multipliers the solver returns, not the
+primal value, which a first-order solver such as SCS does not bound.
+
+The solver 'auto' picks MOSEK if a license can be checked out and otherwise
+falls back to the license-free solvers, so the scripts also run on machines
+without a MOSEK license.
+"""
+
+import json
+import time
+
+import numpy as np
+from scipy.sparse import coo_matrix
+
+import profiling
+
+# Order in which the solver 'auto' tries the solvers
+FALLBACK = ('mosek', 'scs', 'cvxopt')
+
+# Statuses reported by ncpol2sdpa and cvxpy mapped to the ones kept in the
+# solves, anything else becomes 'unknown'
+STATUSES = {
+    'optimal': 'optimal',
+    'primal-dual feasible': 'optimal',
+    'optimal_inaccurate': 'inaccurate',
+    'infeasible': 'infeasible',
+    'primal infeasible': 'infeasible',
+    'infeasible_inaccurate': 'infeasible',
+    'unbounded': 'unbounded',
+    'dual infeasible': 'unbounded',
+    'unbounded_inaccurate': 'unbounded',
+}
+
+
+def normalize_status(status):
+    return STATUSES.get(str(status).lower(), 'unknown')
+
+
+def _mosek_licensed():
+    try:
+        import mosek
+        with mosek.Env() as env:
+            env.checkoutlicense(mosek.feature.pts)
+    except Exception:
+        return False
+    return True
+
+
+def available(solver):
+    if solver == 'mosek':
+        return _mosek_licensed()
+    try:
+        import cvxpy as cp
+    except ImportError:
+        return False
+    return solver.upper() in cp.installed_solvers()
+
+
+def resolve(solver='auto'):
+    """
+    The name of the solver that is actually used for solver, which is either
+    a solver name such as 'mosek', 'scs' or 'cvxopt' or 'auto' for the first
+    available solver of FALLBACK. Raises a ValueError if the solver cannot be
+    used on this machine.
+    """
+    solver = solver.lower()
+    if solver != 'auto':
+        if not available(solver):
+            raise ValueError("The solver %s is not available" % solver)
+        return solver
+    for candidate in FALLBACK:
+        if available(candidate):
+            return candidate
+    raise ValueError("None of the solvers %s is available" % ', '.join(FALLBACK))
+
+
+def label(solver, parameters=None):
+    # Name under which solves are kept in the result store. Solves with
+    # parameters such as a loose tolerance are kept apart from the others.
+    if not parameters:
+        return solver
+    return solver + json.dumps(parameters, sort_keys=True)
+
+
+def cvxpy_problem(sdp, copies=1):
+    """
+    Builds a cvxpy problem for the relaxation sdp in which the constant terms
+    of all blocks and the objective are parameters. Returns the problem, the
+    two parameters and the constant terms of the blocks in sdp. F only stores
+    the upper triangle of every block, so the entries are mirrored to get
+    symmetric blocks.
+
+    With copies > 1 the problem holds that many independent copies of sdp
+    with their own moments, constant terms and objective, which are stacked
+    in the parameters and in the constraints copy by copy, see batching.py.
+    """
+    import cvxpy as cp
+
+    F = sdp.F.tocoo()
+    n_vars = sdp.n_vars
+    rows_per_copy = F.shape[0]
+    x = cp.Variable(copies * n_vars)
+    f0 = cp.Parameter(copies * rows_per_copy)
+    c = cp.Parameter(copies * n_vars)
+    blocks = []
+    base = []
+    offset = 0
+    for bs in sdp.block_struct:
+        in_block = (F.row >= offset) & (F.row < offset + bs ** 2)
+        rows, cols, vals = F.row[in_block] - offset, F.col[in_block], F.data[in_block]
+        i, j = rows // bs, rows % bs
+        mirror = i != j
+        rows = np.concatenate([rows, (j * bs + i)[mirror]])
+        cols = np.concatenate([cols, cols[mirror]])
+        vals = np.concatenate([vals, vals[mirror]])
+        block = coo_matrix((vals, (rows, cols)), shape=(bs ** 2, n_vars + 1)).tocsr()
+        base.append(block[:, 0].toarray().ravel())
+        blocks.append((offset, bs, block[:, 1:]))
+        offset += bs ** 2
+    constraints = []
+    for k in range(copies):
+        x_k = x[k * n_vars:(k + 1) * n_vars]
+        for offset, bs, block in blocks:
+            start = k * rows_per_copy + offset
+            expr = block @ x_k + f0[start:start + bs ** 2]
+            if bs > 1:
+                constraints.append(cp.reshape(expr, (bs, bs), order='C') >> 0)
+            else:
+                constraints.append(expr >= 0)
+    problem = cp.Problem(cp.Minimize(c @ x), constraints)
+    return problem, f0, c, np.concatenate(base)
+
+
+def _cvxpy_parameters(solver, parameters):
+    # cvxpy passes MOSEK parameters by their MOSEK names
+    parameters = dict(parameters or {})
+    if solver == 'mosek' and 'num_threads' in parameters:
+        mosek_params = dict(parameters.get('mosek_params', {}))
+        mosek_params['MSK_IPAR_NUM_THREADS'] = parameters.pop('num_threads')
+        parameters['mosek_params'] = mosek_params
+    return parameters
+
+
+def solve_cvxpy(sdp, solver, parameters, cvx, warm_start=False):
+    # Solves sdp through cvx as returned by cvxpy_problem(sdp), whose
+    # constant terms have to be up to date. Returns the solver iterations.
+    problem, f0, c, base = cvx
+    f0.value = base
+    c.value = np.array(sdp.obj_facvar, dtype=float)
+
+    tstart = time.time()
+    value = problem.solve(solver=solver.upper(), warm_start=warm_start,
+                          **_cvxpy_parameters(solver, parameters))
+    sdp.solution_time = time.time() - tstart
+    sdp.status = normalize_status(problem.status)
+    # The multipliers of the blocks, as ncpol2sdpa keeps them after a solve
+    sdp.y_mat = [constraint.dual_value for constraint in problem.constraints]
+    sdp.primal = primal_value(value, sdp.constant_term)
+    sdp.dual = dual_value(sdp.y_mat, sdp.block_struct, f0.value, sdp.constant_term)
+    return problem.solver_stats.num_iters
+
+
+def primal_value(value, constant_term):
+    # The objective value cvxpy reports, None if the solve found no point
+    if value is None or not np.isfinite(value):
+        return None
+    return float(value) + constant_term
+
+
+def dual_value(y_mat, block_struct, f0, constant_term):
+    """
+    The value -tr(F_0 Y) + constant_term of the dual objective at the
+    multipliers y_mat of the blocks, with f0 the constant terms of the full
+    blocks as in cvxpy_problem. The value of the primal is no bound for
+    first-order solvers such as SCS, this one is up to the dual infeasibility
+    of y_mat, see certificates.py for a rigorous bound. None if the solver
+    reported no multipliers.
+    """
+    if not y_mat or any(y is None for y in y_mat):
+        return None
+    y = np.concatenate([np.ravel(y) for y in y_mat])
+    if len(y) != sum(bs ** 2 for bs in block_struct):
+        raise ValueError("The multipliers do not fit the blocks")
+    return float(-(np.asarray(f0, dtype=float) @ y)) + constant_term
+
+
+def row_dual(sdp, row):
+    """
+    The dual multiplier of the 1x1 block of sdp whose constant term is in
+    the given row of F, e.g. of the score constraint, after a solve. None if
+    the solver reported no multipliers.
+    """
+    if not getattr(sdp, 'y_mat', None):
+        return None
+    block = int(np.searchsorted(np.cumsum([bs ** 2 for bs in sdp.block_struct]), row,
+                                side='right'))
+    multiplier = sdp.y_mat[block]
+    return None if multiplier is None else float(np.ravel(multiplier)[0])
+
+
+def solve(sdp, solver='auto', parameters=None):
+    """
+    Solves the relaxation sdp, an ncp.SdpRelaxation with an objective, with
+    solver and the solver specific parameters, e.g. {'eps': 1e-4} for SCS.
+    Returns sdp with normalized status.
+    """
+    solver = resolve(solver)
+    with profiling.phase('solve'):
+        if solver == 'mosek':
+            sdp.solve('mosek', solverparameters=parameters)
+            sdp.status = normalize_status(sdp.status)
+        else:
+            solve_cvxpy(sdp, solver, parameters, cvxpy_problem(sdp))
+    return sdp
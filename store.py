@@ -0,0 +1,149 @@
+"""
+In this module we keep the results of all solves in a local SQLite database so
+that sweeps can skip solves that were already done and results.py can plot
+straight from it. Every solve is identified by a fingerprint of the problem
+description (game, scenario, NPA level, extra monomials, objective), the score,
+the inputs and the solver.
+
+Next to the store every sweep can stream its solves to an append-only JSON
+lines log as soon as they finish. A log survives a crash up to its last
+complete line, so a restarted sweep skips the solves already in it.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+
+from sweep import Solve
+
+# Default location of the result store, next to the scripts
+RESULTS_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.sqlite')
+# Directory for logs given by a bare file name
+LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
+
+
+def problem_hash(problem):
+    return hashlib.sha256(json.dumps(problem, sort_keys=True).encode()).hexdigest()
+
+
+def fingerprint(problem, score, inputs, solver):
+    key = [problem_hash(problem), score, list(inputs), solver]
+    return hashlib.sha256(json.dumps(key).encode()).hexdigest()
+
+
+class ResultStore:
+
+    def __init__(self, path=RESULTS_DB):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS solves (
+                fingerprint TEXT PRIMARY KEY,
+                problem TEXT NOT NULL,
+                score REAL NOT NULL,
+                inputs TEXT NOT NULL,
+                solver TEXT NOT NULL,
+                primal REAL,
+                dual REAL,
+                status TEXT,
+                solution_time REAL,
+                iterations INTEGER,
+                multiplier REAL,
+                certified REAL
+            )""")
+        # Stores created before iteration counts, multipliers and certified
+        # bounds were recorded lack the columns
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(solves)")]
+        if 'iterations' not in columns:
+            self.db.execute("ALTER TABLE solves ADD COLUMN iterations INTEGER")
+        if 'multiplier' not in columns:
+            self.db.execute("ALTER TABLE solves ADD COLUMN multiplier REAL")
+        if 'certified' not in columns:
+            self.db.execute("ALTER TABLE solves ADD COLUMN certified REAL")
+        self.db.execute("CREATE INDEX IF NOT EXISTS solves_problem ON solves (problem, solver)")
+        self.db.commit()
+
+    def get(self, problem, score, inputs, solver):
+        row = self.db.execute(
+            "SELECT dual, primal, status, solution_time, iterations, multiplier, certified "
+            "FROM solves "
+            "WHERE fingerprint = ?",
+            (fingerprint(problem, score, inputs, solver),)).fetchone()
+        return Solve(*row) if row is not None else None
+
+    def put(self, problem, score, inputs, solver, solve):
+        self.db.execute(
+            "INSERT OR REPLACE INTO solves (fingerprint, problem, score, inputs, solver, primal, "
+            "dual, status, solution_time, iterations, multiplier, certified) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (fingerprint(problem, score, inputs, solver), problem_hash(problem), score,
+             json.dumps(list(inputs)), solver, solve.primal, solve.dual, solve.status,
+             solve.solution_time, solve.iterations, solve.multiplier, solve.certified))
+        self.db.commit()
+
+    def solves(self, problem, solver='mosek'):
+        # All stored solves of a problem keyed by (score, inputs) like run_sweep
+        rows = self.db.execute(
+            "SELECT score, inputs, dual, primal, status, solution_time, iterations, multiplier, "
+            "certified FROM solves WHERE problem = ? AND solver = ? ORDER BY score",
+            (problem_hash(problem), solver))
+        return dict(((score, tuple(json.loads(inputs))), Solve(*solve))
+                    for score, inputs, *solve in rows)
+
+    def solver_counts(self, problem):
+        # The number of stored solves of a problem by solver label
+        rows = self.db.execute(
+            "SELECT solver, COUNT(*) FROM solves WHERE problem = ? GROUP BY solver",
+            (problem_hash(problem),))
+        return dict(rows)
+
+    def close(self):
+        self.db.close()
+
+
+class SolveLog:
+    """
+    Append-only JSON lines log of solves with the same get and put as
+    ResultStore. Every put is written and flushed at once. A bare file name
+    is placed in LOG_DIR.
+    """
+
+    def __init__(self, path):
+        if not os.path.dirname(path):
+            os.makedirs(LOG_DIR, exist_ok=True)
+            path = os.path.join(LOG_DIR, path)
+        self.path = path
+        self.entries = {}
+        complete = True
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    complete = line.endswith('\n')
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The last line of a crashed run may be incomplete
+                        continue
+                    self.entries[entry['fingerprint']] = entry
+        self.file = open(path, 'a')
+        if not complete:
+            # New entries must not be appended to an incomplete last line
+            self.file.write('\n')
+
+    def get(self, problem, score, inputs, solver):
+        entry = self.entries.get(fingerprint(problem, score, inputs, solver))
+        # Entries written before a field was added lack it
+        return Solve(*(entry.get(field) for field in Solve._fields)) if entry is not None else None
+
+    def put(self, problem, score, inputs, solver, solve):
+        entry = dict(fingerprint=fingerprint(problem, score, inputs, solver),
+                     problem=problem_hash(problem), score=score, inputs=list(inputs),
+                     solver=solver, **solve._asdict())
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.entries[entry['fingerprint']] = entry
+
+    def close(self):
+        self.file.close()
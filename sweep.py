@@ -0,0 +1,409 @@
+"""
+In this module we run the solves of a score sweep in parallel. Every
+(score, inputs) pair of a sweep is an independent SDP, so the jobs are spread
+over a pool of worker processes. Each worker builds its own relaxation template
+once and then re-solves it for all jobs it receives.
+"""
+
+import warnings
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import batching
+import games
+import profiling
+import solvers
+
+# The parts of a solved relaxation the scripts need, small enough to be sent
+# back from a worker process. multiplier is the dual multiplier of the score
+# constraint, see envelope.py, certified the certified lower bound on the
+# dual, see certificates.py.
+Solve = namedtuple('Solve', ['dual', 'primal', 'status', 'solution_time', 'iterations',
+                             'multiplier', 'certified'],
+                   defaults=(None, None, None))
+# A solve that raised in a worker, with the error it raised
+Failure = namedtuple('Failure', ['error'])
+
+# Relaxation template and objective of the current worker process, together
+# with the function that built them
+_problem = None
+_built_by = None
+
+
+def _limit_threads(solver_threads):
+    # Keeps the BLAS libraries used by numpy and the solvers from starting one
+    # thread per core in every worker. They are loaded by the time a worker
+    # starts, so environment variables would come too late and their thread
+    # pools are limited through threadpoolctl instead, if it is installed.
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(limits=solver_threads)
+
+
+def _solver_parameters(solver, solver_threads, parameters=None):
+    parameters = dict(parameters or {})
+    if solver == 'mosek' and solver_threads is not None:
+        parameters.setdefault('num_threads', solver_threads)
+    return parameters or None
+
+
+def _init_worker(build_problem, solver_threads=None):
+    # Serial sweeps pass no solver_threads and leave the threads of the
+    # calling process alone
+    global _problem, _built_by
+    if solver_threads is not None:
+        _limit_threads(solver_threads)
+    # Serial sweeps of the same problem share the template of this process
+    if _built_by is not build_problem:
+        with profiling.traced(event='build') as record:
+            _problem = build_problem()
+            record.update(_sizes(_problem[0]))
+        _built_by = build_problem
+
+
+def _sizes(template):
+    # Sizes of a RelaxationTemplate or a CompiledRelaxation for the trace
+    sdp = getattr(template, 'sdp', template)
+    return {'moment_matrix_size': sdp.block_struct[0], 'n_vars': sdp.n_vars,
+            'n_blocks': len(sdp.block_struct)}
+
+
+def _solve(job, solver, solver_threads, parameters=None, warm_start=False):
+    # Jobs of run_statistics_sweep also carry the observed moments
+    score, inputs, *statistics = job
+    template, objective = _problem
+    with profiling.traced(event='solve', score=score, inputs=inputs, solver=solver,
+                          warm_start=warm_start) as record:
+        if template.score != score:
+            template.set_score(score)
+        if statistics:
+            template.set_statistics(statistics[0])
+        sdp = template.solve(-objective(*inputs), solver,
+                             _solver_parameters(solver, solver_threads, parameters), warm_start)
+        record.update(_sizes(template), status=sdp.status, dual=sdp.dual,
+                      solution_time=sdp.solution_time, iterations=template.iterations,
+                      multiplier=template.multiplier, certified=template.certified)
+    return Solve(sdp.dual, sdp.primal, sdp.status, sdp.solution_time, template.iterations,
+                 template.multiplier, template.certified)
+
+
+def _try_solve(job, solver, solver_threads, parameters=None, warm_start=False):
+    # A failed solve is returned instead of raised, so that it does not take
+    # the solves of the other jobs down with it
+    try:
+        return _solve(job, solver, solver_threads, parameters, warm_start)
+    except Exception as e:
+        return Failure(repr(e))
+
+
+def _solve_batch(batch, solver, solver_threads, parameters=None):
+    # Solves the jobs of batch in one solver call, see batching.py. If the
+    # batch fails or is not solved to optimality, e.g. because one of its
+    # scores is infeasible, its jobs are solved one by one instead, where a
+    # job that fails again becomes a Failure.
+    template, objective = _problem
+    if len(batch) > 1:
+        scores = [job[0] for job in batch]
+        try:
+            with profiling.traced(event='batch', scores=scores,
+                                  inputs=[job[1] for job in batch], solver=solver) as record:
+                try:
+                    results = batching.solve_batch(
+                        template, [(score, -objective(*inputs), *statistics)
+                                   for score, inputs, *statistics in batch],
+                        solver, _solver_parameters(solver, solver_threads, parameters))
+                except Exception as e:
+                    record.update(error=repr(e))
+                    raise
+                record.update(_sizes(template), copies=len(batch), status=results[0]['status'],
+                              solution_time=sum(r['solution_time'] for r in results))
+        except Exception as e:
+            warnings.warn("The batch of the scores %s failed with %r, its jobs are solved "
+                          "one by one" % (scores, e))
+        else:
+            if all(result['status'] == 'optimal' for result in results):
+                return [Solve(**result) for result in results]
+    return [_try_solve(job, solver, solver_threads, parameters) for job in batch]
+
+
+def _batch_size(batch, n_jobs, workers, solver):
+    # The size of the batches of n_jobs jobs over workers, batch is 'auto' or
+    # a fixed size
+    if batch == 'auto':
+        return batching.batch_size(_problem[0], n_jobs, workers, solver)
+    return int(batch)
+
+
+def _batches(jobs, size):
+    return [jobs[i:i + size] for i in range(0, len(jobs), size)]
+
+
+def _solve_path(path, solver, solver_threads, parameters=None):
+    # Walks through the scores of one input in order, starting every solve
+    # from the solution of the previous score
+    return [_try_solve(job, solver, solver_threads, parameters, warm_start=True)
+            for job in path]
+
+
+def _continuation_paths(jobs):
+    paths = {}
+    for score, inp in sorted(jobs):
+        paths.setdefault(inp, []).append((score, inp))
+    return list(paths.values())
+
+
+def _representatives(inputs, symmetries):
+    # Maps every input to the first input of its equivalence class. Inputs are
+    # equivalent if their objectives coincide after substitution or if one of
+    # the declared symmetries of the game relates them.
+    template, objective = _problem
+    representative = {}
+    seen = {}
+    for inp in inputs:
+        key = template.objective_key(objective(*inp))
+        representative[inp] = seen.setdefault(key, inp)
+    for group in symmetries or []:
+        group = [representative[inp] for inp in group]
+        for inp, rep in representative.items():
+            if rep in group:
+                representative[inp] = group[0]
+    return representative
+
+
+def _answers(jobs, representative):
+    # Maps every job that is actually solved to the jobs it answers
+    answers = {}
+    for score, inp in jobs:
+        answers.setdefault((score, representative[inp]), []).append((score, inp))
+    return answers
+
+
+def sweep_pool(build_problem, workers, solver_threads=1):
+    # A process pool whose workers hold a relaxation template of the problem,
+    # it can be passed to several calls of run_sweep to keep the templates
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                               initargs=(build_problem, solver_threads))
+
+
+def run_sweep(build_problem, scores, inputs, workers=1, solver_threads=1, solver='auto',
+              solver_parameters=None, store=None, problem=None, symmetries=None,
+              continuation=False, pool=None, log=None, batch=None):
+    """
+    Solves the problem returned by build_problem for every score and every
+    entry of inputs. build_problem has to be a module level function (so that
+    it can be sent to the workers) returning a RelaxationTemplate together with
+    a function mapping inputs to the objective that is maximized. The solves
+    are returned as a dict keyed by (score, inputs).
+
+    solver is a solver name of solvers.py or 'auto' for the first available
+    one, solver_parameters are passed on to it, e.g. {'eps': 1e-3} for a quick
+    exploratory sweep with SCS.
+
+    If a ResultStore is given, solves of the problem description problem that
+    are already in the store are not repeated and new solves are added to it.
+    Solves are stored under the solver that was used together with
+    solver_parameters, see solvers.label. A SolveLog given as log is used in
+    the same way. Every solve is written to the store and the log as soon as
+    it finishes, so a crashed sweep resumes where it stopped. Solves that
+    fail do not stop the others, a RuntimeError listing them is raised once
+    all other solves are recorded.
+
+    Inputs whose objectives are identical after substitution are solved only
+    once per score. symmetries can list further groups of inputs that are
+    known to give the same value, e.g. because a relabeling of the game maps
+    one objective onto the other.
+
+    With continuation the scores of every input are solved in increasing
+    order through a parametrized cvxpy problem, warm starting each solve from
+    the previous one where the solver supports it, and the solver iterations
+    of every point are reported in the returned solves. The solves of a path
+    are recorded once the whole path is done.
+
+    With batch, 'auto' or a number of jobs, the jobs are solved in batches of
+    independent relaxations, each batch in a single solver call through
+    cvxpy, see batching.py. 'auto' only batches for solvers with a large
+    overhead per call such as MOSEK, with the size picked from the size of
+    the relaxation, and does not batch relaxations whose solves dominate the
+    overhead of a call. Batches are not solved as continuations.
+
+    A pool from sweep_pool can be given to reuse its workers, otherwise a new
+    pool is started if workers is larger than one.
+
+    With the environment variable MINENTROPY_TRACE set, every build and solve
+    appends a JSON record to the trace file, see profiling.py.
+    """
+    if batch and continuation:
+        raise ValueError("Batches cannot be solved as continuations")
+    solver = solvers.resolve(solver)
+    label = solvers.label(solver, solver_parameters)
+    sinks = [sink for sink in (store, log) if sink is not None]
+    jobs = [(score, inp) for score in scores for inp in inputs]
+    solves = {}
+    for job in jobs:
+        for sink in sinks:
+            solve = sink.get(problem, *job, label)
+            if solve is not None:
+                solves[job] = solve
+                break
+    missing = [job for job in jobs if job not in solves]
+    if not missing:
+        return solves
+
+    failures = []
+
+    def record(job, solve):
+        # Hands a finished solve to every job it answers and to the sinks
+        if isinstance(solve, Failure):
+            failures.append((job, solve.error))
+            return
+        for answered in answers[job]:
+            solves[answered] = solve
+            for sink in sinks:
+                sink.put(problem, *answered, label, solve)
+
+    if workers <= 1 and pool is None:
+        _init_worker(build_problem)
+        representative = _representatives(inputs, symmetries)
+        answers = _answers(missing, representative)
+        if continuation:
+            for path in _continuation_paths(list(answers)):
+                for job in path:
+                    record(job, _try_solve(job, solver, solver_threads, solver_parameters, True))
+        elif batch:
+            for jobs in _batches(list(answers), _batch_size(batch, len(answers), 1, solver)):
+                for job, solve in zip(jobs, _solve_batch(jobs, solver, solver_threads,
+                                                         solver_parameters)):
+                    record(job, solve)
+        else:
+            for job in answers:
+                record(job, _try_solve(job, solver, solver_threads, solver_parameters))
+    else:
+        own_pool = pool is None
+        if own_pool:
+            pool = sweep_pool(build_problem, workers, solver_threads)
+        try:
+            representative = pool.submit(_representatives, inputs, symmetries).result()
+            answers = _answers(missing, representative)
+            if continuation:
+                # Every worker follows whole score paths, which are recorded
+                # once the path is done
+                futures = {pool.submit(_solve_path, path, solver, solver_threads,
+                                       solver_parameters): path
+                           for path in _continuation_paths(list(answers))}
+                for future in as_completed(futures):
+                    for job, solve in zip(futures[future], future.result()):
+                        record(job, solve)
+            elif batch:
+                size = pool.submit(_batch_size, batch, len(answers), workers, solver).result()
+                futures = {pool.submit(_solve_batch, jobs, solver, solver_threads,
+                                       solver_parameters): jobs
+                           for jobs in _batches(list(answers), size)}
+                for future in as_completed(futures):
+                    for job, solve in zip(futures[future], future.result()):
+                        record(job, solve)
+            else:
+                futures = {pool.submit(_try_solve, job, solver, solver_threads,
+                                       solver_parameters): job
+                           for job in answers}
+                for future in as_completed(futures):
+                    record(futures[future], future.result())
+        finally:
+            if own_pool:
+                pool.shutdown()
+
+    if failures:
+        raise RuntimeError("%d solves failed, all others are recorded: %s" % (
+            len(failures), "; ".join("%s: %s" % failure for failure in failures)))
+    return solves
+
+
+def run_statistics_sweep(build_problem, game, distributions, inputs, workers=1,
+                         solver_threads=1, solver='auto', solver_parameters=None, pool=None,
+                         batch=None):
+    """
+    Solves the problem returned by build_problem conditioned on every observed
+    distribution of game in distributions[n, a, b, x, y] and for every entry
+    of inputs. The template of build_problem has to fix the moments of the
+    statistic monomials, see games.observed_moments. The moments and scores
+    of the whole batch are computed in one pass, afterwards every solve only
+    edits the constant terms of the template of its worker. The solves are
+    returned as a dict keyed by (n, inputs).
+
+    The other arguments, batch included, work as for run_sweep. Inputs whose
+    objectives are identical after substitution are solved only once per
+    distribution, the symmetries of the game are not used as they do not
+    hold for observed distributions in general. Failed solves raise a RuntimeError once all
+    other solves are done.
+    """
+    if np.shape(distributions)[-4:] != game.shape:
+        raise ValueError("Expected distributions of shape %s" % (game.shape,))
+    solver = solvers.resolve(solver)
+    distributions = np.reshape(distributions, (-1,) + game.shape)
+    moments = games.observed_moments(distributions)
+    scores = game.score(distributions)
+    solves = {}
+    answers = {}
+    failures = []
+
+    def job(key):
+        n, inp = key
+        return float(scores[n]), inp, moments[n]
+
+    def record(key, solve):
+        if isinstance(solve, Failure):
+            failures.append((key, solve.error))
+            return
+        n, inp = key
+        for _, answered in answers[(None, inp)]:
+            solves[(n, answered)] = solve
+
+    def keys(representative):
+        # Every distribution with every input that is actually solved
+        answers.update(_answers([(None, inp) for inp in inputs], representative))
+        return [(n, inp) for n in range(len(distributions)) for _, inp in answers]
+
+    if workers <= 1 and pool is None:
+        _init_worker(build_problem)
+        todo = keys(_representatives(inputs, None))
+        if batch:
+            for batch_keys in _batches(todo, _batch_size(batch, len(todo), 1, solver)):
+                for key, solve in zip(batch_keys, _solve_batch(
+                        [job(key) for key in batch_keys], solver, solver_threads,
+                        solver_parameters)):
+                    record(key, solve)
+        else:
+            for key in todo:
+                record(key, _try_solve(job(key), solver, solver_threads, solver_parameters))
+    else:
+        own_pool = pool is None
+        if own_pool:
+            pool = sweep_pool(build_problem, workers, solver_threads)
+        try:
+            representative = pool.submit(_representatives, inputs, None).result()
+            todo = keys(representative)
+            if batch:
+                size = pool.submit(_batch_size, batch, len(todo), workers, solver).result()
+                futures = {pool.submit(_solve_batch, [job(key) for key in batch_keys], solver,
+                                       solver_threads, solver_parameters): batch_keys
+                           for batch_keys in _batches(todo, size)}
+                for future in as_completed(futures):
+                    for key, solve in zip(futures[future], future.result()):
+                        record(key, solve)
+            else:
+                futures = {pool.submit(_try_solve, job(key), solver, solver_threads,
+                                       solver_parameters): key
+                           for key in todo}
+                for future in as_completed(futures):
+                    record(futures[future], future.result())
+        finally:
+            if own_pool:
+                pool.shutdown()
+
+    if failures:
+        raise RuntimeError("%d solves failed: %s" % (
+            len(failures), "; ".join("%s: %s" % failure for failure in failures)))
+    return solves
@@ -0,0 +1,118 @@
+"""
+In this module we check the distributed sweeps of cluster.py on a single
+machine with local workers on CHSH with SCS: that they give the solves of a
+serial sweep, that failed jobs and jobs whose lease ran out are tried again
+up to max_attempts times and that a result coming in together with the
+expiry of its lease is taken. Run with
+
+    python -m pytest -q
+"""
+
+import pytest
+
+import pipeline
+import solvers
+import sweep
+from cluster import DirectoryQueue, run_distributed_sweep
+from store import ResultStore
+from sweep import Solve
+
+SCORES = [0.8, 0.84]
+ENTROPIES = [0.1940, 0.5272]
+INPUTS = [(0,)]
+
+
+def chsh_spec(**spec):
+    return pipeline.check_spec(dict({'game': 'chsh', 'scores': SCORES, 'inputs': INPUTS,
+                                     'solver': 'scs', 'solver_parameters': {'eps': 1e-6}},
+                                    **spec))
+
+
+def stored(store, spec):
+    return store.solves(pipeline.problem_description(spec),
+                        solvers.label(spec['solver'], spec['solver_parameters']))
+
+
+def entropies(solves):
+    return [pipeline.ent(solves[(score, inp)]) for score in SCORES for inp in INPUTS]
+
+
+class DeadWorkerQueue(DirectoryQueue):
+    # The first attempt of every job is claimed by a worker that dies at once
+
+    def put(self, job):
+        self._write('claimed' if job['attempts'] == 1 else 'pending', job['id'], job)
+
+
+class RacingQueue(DirectoryQueue):
+    # Every job is solved, but its lease runs out in the same poll as its
+    # result comes in
+
+    def expired(self, lease):
+        jobs = []
+        job = self.claim()
+        while job is not None:
+            solve = Solve(-0.5, -0.5, 'optimal', 0.0, None, None, None)
+            self.finish(job['id'], {'solve': solve._asdict(), 'host': 'test'})
+            jobs.append(job)
+            job = self.claim()
+        return jobs
+
+
+def test_local_workers(tmp_path):
+    store = ResultStore(str(tmp_path / 'results.sqlite'))
+    spec = chsh_spec()
+    solves = run_distributed_sweep(spec, DirectoryQueue(str(tmp_path / 'queue')), store,
+                                   poll=0.1, local_workers=2)
+    assert entropies(solves) == pytest.approx(ENTROPIES, abs=5e-4)
+    assert stored(store, spec) == solves
+    store.close()
+
+
+def test_failed_job(tmp_path, monkeypatch):
+    # The local workers are forked and so inherit the failing solve
+    attempts = tmp_path / 'attempts'
+    try_solve = sweep._try_solve
+
+    def failing(job, *args, **kwargs):
+        if job[0] == SCORES[1]:
+            with open(attempts, 'a') as f:
+                f.write('%s\n' % (job,))
+            raise RuntimeError("made to fail")
+        return try_solve(job, *args, **kwargs)
+
+    monkeypatch.setattr(sweep, '_try_solve', failing)
+    store = ResultStore(str(tmp_path / 'results.sqlite'))
+    spec = chsh_spec()
+    with pytest.raises(RuntimeError, match="1 solves failed.*made to fail"):
+        run_distributed_sweep(spec, DirectoryQueue(str(tmp_path / 'queue')), store,
+                              max_attempts=2, poll=0.1, local_workers=1)
+    assert len(attempts.read_text().splitlines()) == 2
+    # The other job is recorded
+    assert list(stored(store, spec)) == [(SCORES[0], INPUTS[0])]
+    store.close()
+
+
+def test_lease_expired(tmp_path):
+    queue = DeadWorkerQueue(str(tmp_path / 'queue'))
+    solves = run_distributed_sweep(chsh_spec(), queue, lease=1, poll=0.1, local_workers=1)
+    assert entropies(solves) == pytest.approx(ENTROPIES, abs=5e-4)
+
+    queue = DeadWorkerQueue(str(tmp_path / 'failing'))
+    with pytest.raises(RuntimeError, match="2 solves failed.*lease expired"):
+        run_distributed_sweep(chsh_spec(), queue, lease=0.2, max_attempts=1, poll=0.1)
+
+
+def test_expired_with_result(tmp_path):
+    queue = RacingQueue(str(tmp_path / 'queue'))
+    solves = run_distributed_sweep(chsh_spec(), queue, poll=0.1)
+    assert [solve.dual for solve in solves.values()] == [-0.5] * len(SCORES)
+    # No job was put back on the queue
+    assert queue.claim() is None
+
+
+def test_unsupported():
+    for spec in (chsh_spec(mode='adaptive'), chsh_spec(continuation=True),
+                 chsh_spec(batch=2)):
+        with pytest.raises(ValueError, match="Distributed sweeps do not support"):
+            run_distributed_sweep(spec, None)
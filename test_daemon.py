@@ -0,0 +1,59 @@
+"""
+In this module we check the daemon of daemon.py on CHSH with SCS: a query
+sent over its Unix socket is answered with the solves of run_sweep, also
+from the relaxation it keeps, a failed query does not stop it and it
+stops when asked to. Run with
+
+    python -m pytest -q
+"""
+
+import time
+from multiprocessing import Process
+
+import pytest
+
+import daemon
+import pipeline
+from sweep import run_sweep
+
+SPEC = {'game': 'chsh', 'scores': [0.8, 0.84], 'inputs': [[0]], 'solver': 'scs',
+        'solver_parameters': {'eps': 1e-6}}
+
+
+@pytest.fixture
+def address(tmp_path):
+    address = str(tmp_path / 'daemon.sock')
+    process = Process(target=daemon.serve, args=(address,), daemon=True)
+    process.start()
+    # The daemon imports everything before it opens the socket
+    deadline = time.time() + 120
+    while True:
+        try:
+            assert daemon._request('ping', address) == {'pong': True}
+            break
+        except OSError:
+            assert process.is_alive() and time.time() < deadline
+            time.sleep(0.1)
+    yield address
+    assert daemon.stop(address) == {'stopped': True}
+    process.join(10)
+    assert process.exitcode == 0
+
+
+def test_query(address):
+    spec = pipeline.check_spec(dict(SPEC))
+    expected = run_sweep(pipeline.spec_build(spec), spec['scores'], pipeline.spec_inputs(spec),
+                         solver=spec['solver'], solver_parameters=spec['solver_parameters'])
+    for _ in range(2):
+        scores, solves, entropies = daemon.submit(SPEC, address)
+        assert scores == spec['scores']
+        assert set(solves) == set(expected)
+        for job, solve in expected.items():
+            assert solves[job]['status'] == solve.status
+            assert solves[job]['dual'] == pytest.approx(solve.dual, abs=1e-6)
+        assert entropies == pytest.approx([pipeline.ent(expected[(score, (0,))])
+                                           for score in scores], abs=1e-6)
+
+    with pytest.raises(RuntimeError, match="The query failed"):
+        daemon.submit(dict(SPEC, mode='unknown'), address)
+    assert daemon.submit(SPEC, address)[0] == spec['scores']
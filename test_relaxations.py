@@ -0,0 +1,116 @@
+"""
+In this module we check the relaxations of pipeline.py on CHSH with SCS: the
+certified bounds, the streaming assembly against ncpol2sdpa, also on CGLMP_3,
+the decomposition against the operators W and the cliques of the sparse mode.
+Run with
+
+    python -m pytest -q
+"""
+
+import random
+from itertools import combinations
+
+import pytest
+
+import pipeline
+from assembly import assembled_problem
+from certificates import certified_entropy, round_down
+from relaxation import chordal_cliques
+
+# Scores of CHSH and the entropies H_min(A|E) the operators W give at them
+SCORES = [0.8, 0.84]
+ENTROPIES = [0.1940, 0.5272]
+
+
+def chsh_spec(**spec):
+    return pipeline.check_spec(dict({'game': 'chsh', 'scores': SCORES, 'solver': 'scs',
+                                     'solver_parameters': {'eps': 1e-6}}, **spec))
+
+
+def entropies(spec):
+    scores, solves = pipeline.run_spec(spec)
+    return [pipeline.ent(solves[(score, (0,))]) for score in scores], solves
+
+
+@pytest.fixture(scope='module')
+def operator_solves():
+    return entropies(chsh_spec())
+
+
+def test_operators(operator_solves):
+    h, _ = operator_solves
+    assert h == pytest.approx(ENTROPIES, abs=5e-4)
+
+
+def test_certified_below_dual(operator_solves):
+    _, solves = operator_solves
+    for solve in solves.values():
+        assert solve.certified is not None
+        assert solve.certified <= solve.dual
+        assert solve.certified == pytest.approx(solve.dual, abs=1e-4)
+        assert certified_entropy(solve) <= pipeline.ent(solve)
+        # The reported bound never claims more than is certified
+        assert float(round_down(solve.certified)) <= solve.certified
+
+
+def test_decomposition():
+    h, _ = entropies(chsh_spec(formulation='decomposition'))
+    assert h == pytest.approx(ENTROPIES, abs=5e-4)
+
+
+@pytest.mark.parametrize('game, level', [('chsh', 1), ('chsh', 2),
+                                         ({'name': 'cglmp', 'd': 3}, 2)])
+def test_streaming_assembly(tmp_path, game, level):
+    spec = chsh_spec(game=game, level=level)
+    template, _ = pipeline.build_problem(spec)
+    game = pipeline.make_game(spec['game'])
+    compiled, _ = assembled_problem(str(tmp_path / 'assembled'), game,
+                                    *pipeline.configs(spec, game), True, level, SCORES[0],
+                                    pipeline.spec_inputs(spec), spec['extra_monos'])
+    assert list(compiled.block_struct) == list(template.sdp.block_struct)
+    # ncpol2sdpa allocates more columns than it has moments, the rest are empty
+    F = template.sdp.F.tocsc()
+    n = template.sdp.n_vars + 1
+    assert F[:, n:].nnz == 0
+    assert compiled.F.shape == (F.shape[0], n)
+    assert (compiled.F != F[:, :n]).nnz == 0
+
+
+def maximal_cliques(n, edges):
+    # All maximal cliques of a graph by going through every set of vertices
+    cliques = [set(c) for size in range(1, n + 1) for c in combinations(range(n), size)
+               if all(frozenset(e) in edges for e in combinations(c, 2))]
+    return sorted(sorted(c) for c in cliques if not any(c < other for other in cliques))
+
+
+def is_chordal(n, edges):
+    # No set of four or more vertices induces a cycle
+    for size in range(4, n + 1):
+        for c in combinations(range(n), size):
+            degrees = [sum(frozenset((u, v)) in edges for v in c if v != u) for u in c]
+            if all(d == 2 for d in degrees):
+                # A 2-regular induced graph is a cycle if it is connected
+                seen, stack = {c[0]}, [c[0]]
+                while stack:
+                    u = stack.pop()
+                    for v in c:
+                        if v not in seen and frozenset((u, v)) in edges:
+                            seen.add(v)
+                            stack.append(v)
+                if len(seen) == size:
+                    return False
+    return True
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_chordal_cliques(seed):
+    rng = random.Random(seed)
+    n = rng.randint(1, 8)
+    density = rng.random()
+    edges = [e for e in combinations(range(n), 2) if rng.random() < density]
+    cliques = chordal_cliques(n, edges)
+    # The cliques are those of a chordal graph that contains the graph
+    extension = {frozenset(e) for c in cliques for e in combinations(c, 2)}
+    assert {frozenset(e) for e in edges} <= extension
+    assert is_chordal(n, extension)
+    assert sorted(cliques) == maximal_cliques(n, extension)
@@ -0,0 +1,115 @@
+"""
+In this module we check the sweeps of sweep.py on CHSH with SCS: that the
+workers, batches and continuations give the same entropies as a serial
+sweep, that an interrupted log is resumed without solving its solves again
+and that stores without the later columns are migrated. Run with
+
+    python -m pytest -q
+"""
+
+import json
+import sqlite3
+
+import pytest
+
+import pipeline
+import solvers
+import sweep
+from store import ResultStore, SolveLog, fingerprint, problem_hash
+from sweep import Solve
+
+SCORES = [0.8, 0.84]
+INPUTS = [(0,)]
+
+
+def chsh_spec(**spec):
+    return pipeline.check_spec(dict({'game': 'chsh', 'scores': SCORES, 'inputs': INPUTS,
+                                     'solver': 'scs', 'solver_parameters': {'eps': 1e-6}},
+                                    **spec))
+
+
+def entropies(spec):
+    scores, solves = pipeline.run_spec(spec)
+    return [pipeline.ent(solves[(score, inp)]) for score in scores for inp in INPUTS]
+
+
+@pytest.fixture(scope='module')
+def serial():
+    return entropies(chsh_spec())
+
+
+@pytest.mark.parametrize('options', [{'workers': 2}, {'batch': 2}, {'continuation': True}])
+def test_same_entropies(serial, options):
+    assert entropies(chsh_spec(**options)) == pytest.approx(serial, abs=5e-4)
+
+
+def test_resume_log(tmp_path, monkeypatch):
+    path = str(tmp_path / 'chsh.jsonl')
+    spec = chsh_spec(log=path)
+    _, first = pipeline.run_spec(spec)
+    # The run is interrupted while writing the solve of the second score
+    with open(path) as f:
+        lines = f.readlines()
+    assert len(lines) == len(SCORES)
+    with open(path, 'w') as f:
+        f.write(lines[0] + lines[1][:len(lines[1]) // 2])
+
+    solved = []
+    try_solve = sweep._try_solve
+
+    def counting(job, *args, **kwargs):
+        solved.append(job)
+        return try_solve(job, *args, **kwargs)
+
+    monkeypatch.setattr(sweep, '_try_solve', counting)
+    _, resumed = pipeline.run_spec(spec)
+    assert solved == [(SCORES[1], INPUTS[0])]
+    # The solve in the log is taken as it is, down to its solution time
+    assert resumed[(SCORES[0], INPUTS[0])] == first[(SCORES[0], INPUTS[0])]
+    assert pipeline.ent(resumed[(SCORES[1], INPUTS[0])]) == \
+        pytest.approx(pipeline.ent(first[(SCORES[1], INPUTS[0])]), abs=5e-4)
+
+    # Both solves are in the log now and nothing is solved any more
+    solved.clear()
+    pipeline.run_spec(spec)
+    assert solved == []
+    log = SolveLog(path)
+    label = solvers.label(spec['solver'], spec['solver_parameters'])
+    assert all(log.get(pipeline.problem_description(spec), score, INPUTS[0], label)
+               for score in SCORES)
+    log.close()
+
+
+def test_store_migration(tmp_path):
+    path = str(tmp_path / 'results.sqlite')
+    problem = {'game': 'chsh'}
+    # The schema before iteration counts, multipliers and certified bounds
+    db = sqlite3.connect(path)
+    db.execute("""
+        CREATE TABLE solves (
+            fingerprint TEXT PRIMARY KEY,
+            problem TEXT NOT NULL,
+            score REAL NOT NULL,
+            inputs TEXT NOT NULL,
+            solver TEXT NOT NULL,
+            primal REAL,
+            dual REAL,
+            status TEXT,
+            solution_time REAL
+        )""")
+    db.execute("INSERT INTO solves VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+               (fingerprint(problem, 0.8, (0,), 'mosek'), problem_hash(problem), 0.8,
+                json.dumps([0]), 'mosek', -0.87, -0.87, 'optimal', 1.5))
+    db.commit()
+    db.close()
+
+    store = ResultStore(path)
+    assert store.get(problem, 0.8, (0,), 'mosek') == \
+        Solve(-0.87, -0.87, 'optimal', 1.5, None, None, None)
+    solve = Solve(-0.9, -0.9, 'optimal', 2.0, 12, 0.5, -0.9001)
+    store.put(problem, 0.84, (0,), 'mosek', solve)
+    assert store.get(problem, 0.84, (0,), 'mosek') == solve
+    assert set(store.solves(problem)) == {(0.8, (0,)), (0.84, (0,))}
+    store.close()
+    # Opening a migrated store again leaves it as it is
+    ResultStore(path).close()